@@ -0,0 +1,161 @@
+"""
+Converts many .npy/.npz density frames (e.g. density_0001.npy ...) to .vdb files in
+parallel, with vdb_io (no Blender needed). Frames converted by a previous run (recorded
+in the manifest) whose .vdb is newer than the input, or whose input hash matches the
+recorded one, are skipped, so re-running only converts new or changed frames. The
+manifest (manifest.json in the output folder) records per-file hashes, timings and sizes,
+or the error of frames that failed (which are converted again on the next run). Each
+.vdb is written under a temporary name and renamed once complete, so an interrupted run
+leaves no partial .vdb behind.
+
+    python batch_convert.py "data/density_*.npy" blender/vdb_files/ [--workers=8] [--half] [--no-compress] [--force]
+"""
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import vdb_io
+from render_jobs import process_context
+
+
+def find_frames(source):
+    """
+    Input frames of a folder (its .npy and .npz files) or a glob pattern, sorted by name.
+    """
+    if os.path.isdir(source):
+        source = os.path.join(source, '*')
+    return sorted(path for path in glob.glob(source) if path.endswith(('.npy', '.npz')))
+
+
+def file_hash(path, block=1 << 24):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(block), b''):
+            h.update(data)
+    return h.hexdigest()
+
+
+def convert_frame(npy_path, vdb_path, **options):
+    """
+    Converts one frame (a .npy, memory-mapped, or the first array of a .npz).
+    :return: Manifest entry of the frame.
+    """
+    start = time.perf_counter()
+    lod_levels = options.pop('lod_levels', 0)
+
+    if npy_path.endswith('.npz'):
+        with np.load(npy_path) as f:
+            density = f[f.files[0]]
+    else:
+        density = np.load(npy_path, mmap_mode='r')
+
+    # The .vdb only appears once complete (after its LOD levels), so a frame interrupted
+    # half-way is never taken for converted
+    tmp_path = vdb_path + '.tmp'
+    try:
+        vdb_io.export_density(density, tmp_path, **options)
+        if lod_levels:
+            vdb_io.export_lods(density, vdb_path, lod_levels, **options)
+        os.replace(tmp_path, vdb_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return {'output': os.path.basename(vdb_path),
+            'input_hash': file_hash(npy_path),
+            'input_bytes': os.path.getsize(npy_path),
+            'output_bytes': os.path.getsize(vdb_path),
+            'seconds': time.perf_counter() - start}
+
+
+def batch_convert(source, savefold, workers=None, force=False, **options):
+    """
+    Converts the frames of source (see find_frames) to savefold/<name>.vdb over a
+    process pool, skipping up-to-date outputs (unless force).
+    :param workers: Number of processes (defaults to os.cpu_count()).
+    :param options: Options of vdb_io.convert_npy (half, compress, crop, threshold, tile, lod_levels).
+    :return: The manifest, {input file name: entry}.
+    """
+    frames = find_frames(source)
+    if not frames:
+        raise ValueError(f'No .npy or .npz files in {source}.')
+
+    os.makedirs(savefold, exist_ok=True)
+    manifest_path = os.path.join(savefold, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    tasks = []
+    for npy_path in frames:
+        name = os.path.basename(npy_path)
+        vdb_path = os.path.join(savefold, os.path.splitext(name)[0] + '.vdb')
+
+        converted = name in manifest and 'error' not in manifest[name]
+        if not force and converted and os.path.exists(vdb_path):
+            if os.path.getmtime(vdb_path) >= os.path.getmtime(npy_path):
+                continue
+            # Touched but unchanged inputs (e.g. copied frames) are recognized by their hash
+            if name in manifest and manifest[name]['input_hash'] == file_hash(npy_path):
+                continue
+
+        tasks.append((npy_path, vdb_path))
+
+    print(f'Converting {len(tasks)} of {len(frames)} frames')
+    if not tasks:
+        return manifest
+
+    if workers is None:
+        workers = os.cpu_count()
+    context = process_context()
+
+    start = time.perf_counter()
+    failures = 0
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=context) as executor:
+            futures = {executor.submit(convert_frame, npy_path, vdb_path, **options): (npy_path, vdb_path)
+                       for npy_path, vdb_path in tasks}
+            for future in as_completed(futures):
+                npy_path, vdb_path = futures[future]
+                name = os.path.basename(npy_path)
+                try:
+                    manifest[name] = future.result()
+                except Exception as error:
+                    # A bad frame is recorded (and converted again next run), the others go on
+                    failures += 1
+                    manifest[name] = {'output': os.path.basename(vdb_path),
+                                      'error': f'{type(error).__name__}: {error}'}
+                    if os.path.exists(vdb_path):
+                        os.remove(vdb_path)
+                    print(f'Failed to convert {name}: {error}')
+    finally:
+        # Written even if the run is interrupted, so converted frames are not redone
+        manifest = dict(sorted(manifest.items()))
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+    print(f'Converted {len(tasks) - failures} frames in {time.perf_counter() - start:.1f} s'
+          + (f', {failures} failed' if failures else ''))
+
+    return manifest
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if len(args) != 2:
+        print(__doc__)
+        sys.exit(1)
+
+    workers = [int(arg.split('=')[1]) for arg in sys.argv if arg.startswith('--workers=')]
+    manifest = batch_convert(args[0], args[1], workers=workers[0] if workers else None,
+                             force='--force' in sys.argv, half='--half' in sys.argv,
+                             compress='--no-compress' not in sys.argv)
+    sys.exit(1 if any('error' in entry for entry in manifest.values()) else 0)
@@ -11,7 +11,9 @@ import local_blutils as lblut
 importlib.reload(lblut)
 
 density_npy_path = cwd  + '/data/density.npy'
-density_arr = np.load(density_npy_path)
+# Memory-mapped, so the cube is read slab by slab by save_vdb instead of loaded whole
+density_arr = np.load(density_npy_path, mmap_mode='r')
 
 savefold = cwd + '/blender/vdb_files/'
-lblut.save_vdb(density_arr, savefold=savefold, filename=f'density')
\ No newline at end of file
+# Also writes density_lod2/4/8.vdb, downsampled levels for quick previews
+lblut.save_vdb(density_arr, savefold=savefold, filename=f'density', lod_levels=3)
\ No newline at end of file
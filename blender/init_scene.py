@@ -1,5 +1,53 @@
+import time
+
 import bpy
 
+from instrumentation import instrument
+
+# bpy.data collections emptied by reset_data
+RESET_TYPES = ['objects', 'materials', 'lights', 'cameras', 'images', 'meshes', 'volumes',
+               'collections', 'worlds']
+
+
+@instrument.timed('scene_reset')
+def reset_data(data_types=RESET_TYPES, purge=True, verbose=True):
+    """
+    Removes every datablock of the given bpy.data collections (except the default
+    collection), with one batch_remove call per type instead of one remove per datablock.
+    Then purges orphan data (e.g. node groups of removed materials) until none is left.
+    :return: Number of removed datablocks per type and of purged orphans, and the time
+        taken in 'seconds'.
+    """
+    start = time.perf_counter()
+    counts = {}
+
+    for data_type in data_types:
+        datablocks = list(getattr(bpy.data, data_type))
+        if data_type == 'collections':
+            datablocks = [c for c in datablocks if c.name not in ['Collection', 'Master Collection']]
+        if datablocks:
+            bpy.data.batch_remove(datablocks)
+        counts[data_type] = len(datablocks)
+        instrument.count(f'removed_{data_type}', len(datablocks))
+
+    if purge:
+        # Purging can leave new orphans (data only used by purged data), so repeat until none
+        counts['orphans'] = 0
+        while True:
+            purged = bpy.data.orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=True)
+            if not purged:
+                break
+            counts['orphans'] += purged
+
+    if verbose:
+        removed = ', '.join(f'{n} {data_type}' for data_type, n in counts.items() if n)
+        print(f'Scene reset in {time.perf_counter() - start:.3f} s: removed {removed or "nothing"}')
+
+    counts['seconds'] = time.perf_counter() - start
+
+    return counts
+
+
 class Scene():
 
     def __init__(self, clean=True, alpha=0.5, clip_start=0.1,
@@ -10,35 +58,10 @@ class Scene():
             if bpy.context.mode != "OBJECT":
                 bpy.ops.object.mode_set(mode="OBJECT")
 
-            # Delete all objects in the scene
-            if bpy.data.objects:
-                bpy.ops.object.select_all(action="SELECT")
-                bpy.ops.object.delete()
-
-            # delete all materials in the scene
-            if bpy.data.materials:
-                for material in bpy.data.materials:
-                    bpy.data.materials.remove(material)
-
-            # delete all lights
-            if bpy.data.lights:
-                for light in bpy.data.lights:
-                    bpy.data.lights.remove(light)
-            
-            # delete all cameras
-            if bpy.data.cameras:
-                for camera in bpy.data.cameras:
-                    bpy.data.cameras.remove(camera)
-
-            # delete all images
-            if bpy.data.images:
-                for image in bpy.data.images:
-                    bpy.data.images.remove(image)
-
-            # delete all meshes
-            if bpy.data.meshes:
-                for mesh in bpy.data.meshes:
-                    bpy.data.meshes.remove(mesh)
+            # Delete all objects, materials, lights, cameras, images, meshes, volumes,
+            # collections and worlds, and the data left unused (counts and time of the
+            # reset in self.reset_counts)
+            self.reset_counts = reset_data()
 
             view_layers = bpy.context.scene.view_layers
             for vl in view_layers:
@@ -49,19 +72,6 @@ class Scene():
             # Remove all handlers
             bpy.app.handlers.frame_change_pre.clear()
 
-            # Delete all collections except the default "Collection" and "Master Collection"
-            collections_to_delete = [
-                c
-                for c in bpy.data.collections
-                if c.name not in ["Collection", "Master Collection"]
-            ]
-            for collection in collections_to_delete:
-                bpy.data.collections.remove(collection)
-
-            # Remove all worlds
-            for world in bpy.data.worlds:
-                bpy.data.worlds.remove(world)
-
             # Ensure all changes to data are reflected in the scene
             bpy.context.view_layer.update()
 
@@ -139,7 +149,8 @@ class Scene():
                    tiles=(256, 256),
                    adaptative_threshold=0.01,
                    volume_step=100,
-                   volume_max_steps=2):
+                   volume_max_steps=2,
+                   volume_step_rate=100):
 
         bpy.context.scene.render.engine = "CYCLES"
 
@@ -194,10 +205,24 @@ class Scene():
 
         cycles.volume_step_size = volume_step  # Adjust based on desired detail and render time
         cycles.volume_max_steps = volume_max_steps  # Increase or decrease based on complexity
-        # viewport step size
-        cycles.volume_step_rate = 100
+        # Step size of volume objects, in voxels (see render_tuning.volume_settings)
+        cycles.volume_step_rate = volume_step_rate
 
         return
+
+    def set_volume_settings(self, settings):
+        """
+        Applies the Cycles and EEVEE volume settings of render_tuning.volume_settings.
+        """
+        cycles = bpy.context.scene.cycles
+        eevee = bpy.context.scene.eevee
+
+        cycles.volume_step_rate = settings['volume_step_rate']
+        cycles.volume_preview_step_rate = settings['volume_preview_step_rate']
+        cycles.volume_max_steps = settings['volume_max_steps']
+
+        eevee.volumetric_tile_size = f"{settings['volumetric_tile_size']}"
+        eevee.volumetric_samples = settings['volumetric_samples']
     
 
 def set_camera(position, 
@@ -0,0 +1,38 @@
+"""
+Stage instrumentation of the Blender scripts: the instrument module of code/ (see
+code/instrument.py) when it is there, else no-op stand-ins, so these scripts also work
+without code/.
+
+    from instrumentation import instrument
+"""
+import os
+import sys
+from contextlib import nullcontext
+
+code_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code')
+if os.path.isdir(code_dir) and code_dir not in sys.path:
+    sys.path.append(code_dir)
+
+try:
+    import instrument
+except ImportError:
+    class instrument:
+        """
+        No-op stand-in of code/instrument.py: nothing is timed nor counted.
+        """
+
+        @staticmethod
+        def active():
+            return False
+
+        @staticmethod
+        def count(name, value=1):
+            pass
+
+        @staticmethod
+        def stage(name, **info):
+            return nullcontext()
+
+        @staticmethod
+        def timed(name):
+            return lambda func: func
@@ -1,20 +1,64 @@
 import os
+import glob
 
 import numpy as np
 import bpy
 
-# This library should be available in the Blender Python environment
-import pyopenvdb as vdb
-
-def save_vdb(density, savefold=None, filename='untitled'):
-
-    density = density / np.nanmax(density)
+import vdb_io
+
+from instrumentation import instrument
+
+# Imported volume datablocks, by absolute .vdb path: (file stamp, datablock name)
+_volume_cache = {}
+
+@instrument.timed('save_vdb')
+def save_vdb(density, savefold=None, filename='untitled', crop=False, threshold=0,
+             lod_levels=0, fields=None):
+    """
+    :param fields: Extra grids written in the same pass, {name: func} with func mapping
+        the normalized density to the field, e.g. vdb_io.shading_fields() for
+        volume_material(baked=True). They are active on the same voxels as the density.
+    """
+    # This library should be available in the Blender Python environment (imported here,
+    # so the helpers that do not write grids work without it)
+    import pyopenvdb as vdb
+
+    # Normalize and copy tile by tile, so a memory-mapped density is never fully loaded
+    with instrument.stage('normalize'):
+        max_val = vdb_io.tiled_nanmax(density)
+    # An all-zero or all-NaN frame is written as an empty grid (see vdb_io.export_density)
+    empty = not max_val > 0
     grid = vdb.FloatGrid()
-    grid.copyFromArray(density.astype(float))
-
-    grid.transform = vdb.createLinearTransform(([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]]))
+    field_grids = {field_name: vdb.FloatGrid() for field_name in (fields or {})}
+
+    # Crop to the voxels above threshold; the offset goes into the transform so the
+    # volume keeps its position (see vdb_io.export_density)
+    # (the LOD levels are cropped by export_lods from the full density)
+    offset = [0, 0, 0]
+    cropped = density
+    if crop and not empty:
+        bbox = vdb_io.active_bbox(density, threshold * max_val)
+        if bbox is not None:
+            offset, hi = [int(v) for v in bbox[0]], bbox[1]
+            cropped = density[offset[0]:hi[0], offset[1]:hi[1], offset[2]:hi[2]]
+
+    tiles = vdb_io.iter_tiles(cropped.shape) if not empty else []
+    for tile in tiles:
+        values = np.asarray(cropped[tile], dtype=float) / max_val
+        if threshold > 0:
+            values[values <= threshold] = 0
+        grid.copyFromArray(values, ijk=tuple(s.start for s in tile))
+        for field_name, field_grid in field_grids.items():
+            field = np.where(values != 0, fields[field_name](values), 0)
+            field_grid.copyFromArray(field, ijk=tuple(s.start for s in tile))
+
+    grid.transform = vdb.createLinearTransform(([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], offset + [1]]))
     grid.GridClass = vdb.GridClass.FOG_VOLUME
     grid.name = f'density'
+    for field_name, field_grid in field_grids.items():
+        field_grid.transform = grid.transform
+        field_grid.GridClass = vdb.GridClass.FOG_VOLUME
+        field_grid.name = field_name
 
     cwd = os.getcwd()
 
@@ -26,26 +70,54 @@ def save_vdb(density, savefold=None, filename='untitled'):
 
     filepath = savefold + filename + '.vdb'
 
-    vdb.write(filepath, grids=[grid])
+    vdb.write(filepath, grids=[grid] + list(field_grids.values()))
+    instrument.count('bytes_written', os.path.getsize(filepath))
+
+    # Coarse levels for preview (density_lod2.vdb, density_lod4.vdb, ...), see make_volume
+    if lod_levels:
+        vdb_io.export_lods(density, filepath, lod_levels, crop=crop, threshold=threshold,
+                           norm=max_val, fields=fields)
 
     return filepath
 
 
+@instrument.timed('make_volume')
 def make_volume(filepath, resolution=100, scale=10, center_location=(0, 0, 0), 
-                name=None):
+                name=None, lod=1):
+    """
+    :param lod: Level of detail, as the downsampling factor of the LOD pyramid written
+        by save_vdb (1 for full detail), or 'auto' to choose it from the camera (see choose_lod).
+        Levels can be swapped later with set_lod.
+
+    Each .vdb file is imported once (see volume_data): volumes made from the same file
+    are linked instances sharing one datablock, so materials should be set per object
+    with set_material.
+    """
 
     if name == None:
         object_name = filepath.split('/')[-1].split('.')[0]
     else:
         object_name = name
 
-    vdb_name = filepath.split('/')[-1].split('.')[0]
+    if lod == 'auto':
+        lod = choose_lod(filepath, resolution, scale, center_location)
 
-    bpy.ops.object.volume_import(filepath=filepath, files=[])
+    volume = volume_data(vdb_io.lod_path(filepath, lod))
+    vol_obj = _volume_object(object_name, volume, resolution, scale, center_location)
 
-    vol_obj = bpy.data.objects[vdb_name]
+    vol_obj['lod_filepath'] = filepath
+    vol_obj['lod'] = lod
 
-    vol_obj.name = object_name
+    return vol_obj
+
+
+def _volume_object(object_name, volume, resolution, scale, center_location):
+    """
+    New volume object on the datablock volume, linked to the current collection, scaled
+    and placed so a grid of resolution voxels per side spans scale around center_location.
+    """
+    vol_obj = bpy.data.objects.new(object_name, volume)
+    bpy.context.collection.objects.link(vol_obj)
 
     shape = [resolution, resolution, resolution]
     print(shape)
@@ -63,6 +135,382 @@ def make_volume(filepath, resolution=100, scale=10, center_location=(0, 0, 0),
     return vol_obj
 
 
+def volume_data(filepath):
+    """
+    Volume datablock of a .vdb file. The file is imported on the first call only, and the
+    same datablock is returned afterwards, unless the file changed on disk (modification
+    time or size), in which case the datablock is reloaded in place for all its users.
+    """
+    key = os.path.abspath(filepath)
+    stat = os.stat(key)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+
+    if key in _volume_cache:
+        cached_stamp, data_name = _volume_cache[key]
+        volume = bpy.data.volumes.get(data_name)
+        # The datablock may have been removed or renamed since
+        if volume is not None and os.path.abspath(bpy.path.abspath(volume.filepath)) == key:
+            if cached_stamp != stamp:
+                # Setting the path unloads the grids, which are read again when needed
+                volume.filepath = volume.filepath
+                _volume_cache[key] = (stamp, volume.name)
+                instrument.count('volume_reloads')
+            else:
+                instrument.count('volume_cache_hits')
+            return volume
+
+    volume = bpy.data.volumes.new(os.path.splitext(os.path.basename(key))[0])
+    volume.filepath = key
+    _volume_cache[key] = (stamp, volume.name)
+    instrument.count('volume_imports')
+
+    return volume
+
+
+def clear_volume_cache(filepath=None):
+    """
+    Forgets the imported datablock of filepath (of every file if None), so the next
+    make_volume imports the file again instead of sharing the existing datablock.
+    """
+    if filepath is None:
+        _volume_cache.clear()
+    else:
+        _volume_cache.pop(os.path.abspath(filepath), None)
+
+
+def set_material(vol_obj, material):
+    """
+    Sets the material of a single volume object, without changing other instances
+    sharing its datablock.
+    """
+    if not vol_obj.material_slots:
+        vol_obj.data.materials.append(None)
+
+    vol_obj.material_slots[0].link = 'OBJECT'
+    vol_obj.material_slots[0].material = material
+
+
+def set_lod(vol_obj, lod):
+    """
+    Swaps the level of detail of a volume made by make_volume, by pointing it to the
+    datablock of another level. Its material and transform are kept.
+    """
+    filepath = vol_obj['lod_filepath']
+    if lod not in vdb_io.lod_factors(filepath):
+        raise ValueError(f'No LOD level {lod} for {filepath}.')
+
+    material = vol_obj.active_material
+    vol_obj.data = volume_data(vdb_io.lod_path(filepath, lod))
+    if material is not None:
+        set_material(vol_obj, material)
+    vol_obj['lod'] = lod
+
+
+def choose_lod(filepath, resolution=100, scale=10, center_location=(0, 0, 0), camera=None):
+    """
+    Coarsest available LOD level whose voxels still project to at most one pixel of the
+    render, given the distance to the camera and the render resolution.
+    """
+    size = pixel_size(center_location, camera)
+    if size is None:
+        return 1
+
+    voxel_size = scale / resolution
+    factors = [f for f in vdb_io.lod_factors(filepath) if f * voxel_size <= size]
+
+    return max(factors, default=1)
+
+
+def pixel_size(location=(0, 0, 0), camera=None):
+    """
+    World size of a render pixel at location, seen from camera (the scene camera if None).
+    Returns None if there is no camera.
+    """
+    from mathutils import Vector
+
+    scene = bpy.context.scene
+    if camera is None:
+        camera = scene.camera
+    if camera is None:
+        return None
+
+    pixels = max(scene.render.resolution_x, scene.render.resolution_y)
+    pixels *= scene.render.resolution_percentage / 100
+
+    if camera.data.type == 'ORTHO':
+        return camera.data.ortho_scale / pixels
+
+    distance = (camera.matrix_world.translation - Vector(location)).length
+    return 2 * distance * np.tan(camera.data.angle / 2) / pixels
+
+
+def full_detail_renders():
+    """
+    Registers handlers switching every volume made by make_volume to full detail (lod 1)
+    for final renders, and back to its preview level afterwards.
+    """
+    preview_lods = {}
+
+    def to_full(scene, *args):
+        for obj in scene.objects:
+            if obj.get('lod', 1) != 1:
+                preview_lods[obj.name] = obj['lod']
+                set_lod(obj, 1)
+
+    def to_preview(scene, *args):
+        for name, lod in preview_lods.items():
+            if name in scene.objects:
+                set_lod(scene.objects[name], lod)
+        preview_lods.clear()
+
+    bpy.app.handlers.render_init.append(to_full)
+    bpy.app.handlers.render_complete.append(to_preview)
+    bpy.app.handlers.render_cancel.append(to_preview)
+
+
+class VolumeSequence:
+    """
+    Volume object bound to a numbered sequence of .vdb files (e.g. density_0001.vdb ...),
+    whose data is swapped on frame changes. Only the file of the current frame and the
+    next prefetch files are loaded; datablocks of the other files are removed as the
+    animation moves on, so memory does not grow with the length of the sequence.
+    """
+
+    def __init__(self, files, resolution=100, scale=10, center_location=(0, 0, 0), name=None,
+                 frame_start=1, frame_end=None, stride=1, prefetch=2):
+        """
+        :param files: List of .vdb files, or a glob pattern (sorted by name).
+        :param resolution, scale, center_location, name: As in make_volume.
+        :param frame_start, frame_end: Frames of the first and last file (the sequence is
+            stretched or squeezed in between). frame_end defaults to one file per frame.
+        :param stride: Only every stride-th file is shown (each held for stride files),
+            for quick previews of long sequences.
+        :param prefetch: Number of upcoming files loaded ahead of time.
+        """
+        if isinstance(files, str):
+            files = sorted(glob.glob(files))
+        if not files:
+            raise ValueError('The sequence has no files.')
+
+        self.files = files
+        self.frame_start = frame_start
+        self.frame_end = frame_start + len(files) - 1 if frame_end is None else frame_end
+        self.stride = stride
+        self.prefetch = prefetch
+
+        # Loaded files: file index -> volume datablock name
+        self.resident = {}
+
+        # The object is made directly on the datablock of the current file, so every
+        # datablock it shows is one of the sequence, evicted by update (make_volume would
+        # leave a volume_data datablock behind)
+        index = self.file_index(bpy.context.scene.frame_current)
+        self.load(index)
+        if name is None:
+            name = files[0].split('/')[-1].split('.')[0]
+        self.vol_obj = _volume_object(name, bpy.data.volumes[self.resident[index]], resolution,
+                                      scale, center_location)
+
+        self.handler = lambda scene, *args: self.update(scene.frame_current)
+        bpy.app.handlers.frame_change_pre.append(self.handler)
+        self.update(bpy.context.scene.frame_current)
+
+    def file_index(self, frame):
+        """
+        Index of the file shown at frame (the first or last file outside the frame range).
+        """
+        n = len(self.files)
+        if self.frame_end == self.frame_start:
+            index = 0
+        else:
+            index = round((frame - self.frame_start) / (self.frame_end - self.frame_start) * (n - 1))
+        index = min(max(index, 0), n - 1)
+
+        return index - index % self.stride
+
+    def update(self, frame):
+        """
+        Shows the file of frame, loads the next prefetch files and drops the others.
+        """
+        index = self.file_index(frame)
+        window = self.load(index)
+
+        material = self.vol_obj.active_material
+        self.vol_obj.data = bpy.data.volumes[self.resident[index]]
+        if material is not None:
+            set_material(self.vol_obj, material)
+
+        for i in list(self.resident):
+            if i in window:
+                continue
+            volume = bpy.data.volumes.get(self.resident.pop(i))
+            if volume is not None:
+                bpy.data.volumes.remove(volume)
+
+    def load(self, index):
+        """
+        Loads file index and the next prefetch files (those not loaded yet).
+        :return: Indices of these files.
+        """
+        window = [i for i in range(index, index + self.stride * (self.prefetch + 1), self.stride)
+                  if i < len(self.files)]
+
+        for i in window:
+            if i not in self.resident:
+                # Datablocks of their own (not from volume_data), so evicting them cannot
+                # affect other objects. Blender still shares the grids of the same file.
+                volume = bpy.data.volumes.new(os.path.splitext(os.path.basename(self.files[i]))[0])
+                volume.filepath = os.path.abspath(self.files[i])
+                volume.grids.load()
+                self.resident[i] = volume.name
+
+        return window
+
+    def remove_handler(self):
+        """
+        Stops following frame changes.
+        """
+        if self.handler in bpy.app.handlers.frame_change_pre:
+            bpy.app.handlers.frame_change_pre.remove(self.handler)
+
+
+def volume_node_group(baked=False):
+    """
+    Node group with the volume shading pipeline shared by all materials of volume_material:
+    density -> power -> minimum -> multiply -> emission strength, and
+    density -> divide -> color ramp (black, color 1, color 2) -> emission color.
+    The ramp is built from map range and mix nodes, so its colors and positions are
+    group inputs. Built once per file.
+    :param baked: Read the emission strength (before multiply) and the ramp position from
+        the 'emission' and 'ramp' grids written with vdb_io.shading_fields, instead of
+        computing them from the density at every volume step ('VolumeShadingBaked' group).
+    """
+    name = 'VolumeShadingBaked' if baked else 'VolumeShading'
+    if name in bpy.data.node_groups:
+        return bpy.data.node_groups[name]
+
+    sockets = [('Power', 'NodeSocketFloat'),
+               ('Minimum', 'NodeSocketFloat'),
+               ('Multiply', 'NodeSocketFloat'),
+               ('Divide', 'NodeSocketFloat'),
+               ('Color 1', 'NodeSocketColor'),
+               ('Color 2', 'NodeSocketColor'),
+               ('Position 1', 'NodeSocketFloat'),
+               ('Position 2', 'NodeSocketFloat')]
+    if baked:
+        # Power, minimum and divide are baked into the grids
+        sockets = [socket for socket in sockets if socket[0] not in ('Power', 'Minimum', 'Divide')]
+
+    group = bpy.data.node_groups.new(name, 'ShaderNodeTree')
+    for socket_name, socket_type in sockets:
+        _new_socket(group, socket_name, 'INPUT', socket_type)
+    _new_socket(group, 'Volume', 'OUTPUT', 'NodeSocketShader')
+
+    nodes = group.nodes
+    links = group.links
+
+    group_input = nodes.new(type='NodeGroupInput')
+    group_input.location = (-1000, 0)
+    inputs = group_input.outputs
+
+    multiply_node = nodes.new(type='ShaderNodeMath')
+    multiply_node.operation = 'MULTIPLY'
+    multiply_node.location = (-200, 200)
+    links.new(inputs['Multiply'], multiply_node.inputs[1])
+
+    if baked:
+        emission_node = nodes.new(type='ShaderNodeAttribute')
+        emission_node.attribute_name = 'emission'
+        emission_node.location = (-400, 200)
+        links.new(emission_node.outputs['Fac'], multiply_node.inputs[0])
+
+        ramp_node = nodes.new(type='ShaderNodeAttribute')
+        ramp_node.attribute_name = 'ramp'
+        ramp_node.location = (-600, -200)
+        ramp_position = ramp_node.outputs['Fac']
+    else:
+        volume_info = nodes.new(type='ShaderNodeVolumeInfo')
+        volume_info.location = (-800, 200)
+
+        # Emission strength
+        power_node = nodes.new(type='ShaderNodeMath')
+        power_node.operation = 'POWER'
+        power_node.location = (-600, 200)
+
+        minimum_node = nodes.new(type='ShaderNodeMath')
+        minimum_node.operation = 'MINIMUM'
+        minimum_node.location = (-400, 200)
+
+        links.new(volume_info.outputs['Density'], power_node.inputs[0])
+        links.new(inputs['Power'], power_node.inputs[1])
+        links.new(power_node.outputs[0], minimum_node.inputs[0])
+        links.new(inputs['Minimum'], minimum_node.inputs[1])
+        links.new(minimum_node.outputs[0], multiply_node.inputs[0])
+
+        divide_node = nodes.new(type='ShaderNodeMath')
+        divide_node.operation = 'DIVIDE'
+        divide_node.location = (-600, -200)
+        links.new(volume_info.outputs['Density'], divide_node.inputs[0])
+        links.new(inputs['Divide'], divide_node.inputs[1])
+        ramp_position = divide_node.outputs[0]
+
+    # Emission color: linear ramp from black (at 0) to color 1 (at position 1) to color 2 (at position 2)
+
+    color = None
+    for i, (start, stop, color_1, color_2) in enumerate([(None, 'Position 1', None, 'Color 1'),
+                                                          ('Position 1', 'Position 2', 'Color 1', 'Color 2')]):
+        map_range = nodes.new(type='ShaderNodeMapRange')
+        map_range.clamp = True
+        map_range.location = (-400, -200 - 250 * i)
+        links.new(ramp_position, map_range.inputs['Value'])
+        if start is None:
+            map_range.inputs['From Min'].default_value = 0
+        else:
+            links.new(inputs[start], map_range.inputs['From Min'])
+        links.new(inputs[stop], map_range.inputs['From Max'])
+
+        mix_node = nodes.new(type='ShaderNodeMixRGB')
+        mix_node.location = (-200, -200 - 250 * i)
+        links.new(map_range.outputs[0], mix_node.inputs['Fac'])
+        if color is None:
+            mix_node.inputs['Color1'].default_value = (0, 0, 0, 1)
+        else:
+            links.new(color, mix_node.inputs['Color1'])
+        links.new(inputs[color_2], mix_node.inputs['Color2'])
+        color = mix_node.outputs['Color']
+
+    principled_volume = nodes.new(type='ShaderNodeVolumePrincipled')
+    principled_volume.inputs['Density'].default_value = 0
+    principled_volume.location = (0, 0)
+
+    group_output = nodes.new(type='NodeGroupOutput')
+    group_output.location = (300, 0)
+
+    links.new(multiply_node.outputs[0], principled_volume.inputs['Emission Strength'])
+    links.new(color, principled_volume.inputs['Emission Color'])
+    links.new(principled_volume.outputs['Volume'], group_output.inputs['Volume'])
+
+    return group
+
+
+def _new_socket(group, name, in_out, socket_type):
+    # Blender 4.0 moved group sockets to group.interface
+    if hasattr(group, 'interface'):
+        return group.interface.new_socket(name, in_out=in_out, socket_type=socket_type)
+    sockets = group.inputs if in_out == 'INPUT' else group.outputs
+    return sockets.new(socket_type, name)
+
+
+# Materials of volume_material, by parameters (as stored in their 'volume_params'): material name
+_material_cache = {}
+
+# Object custom properties read by materials made with object_attributes=True
+OBJECT_ATTRIBUTES = {'Color 1': 'volume_color_1',
+                     'Color 2': 'volume_color_2',
+                     'Multiply': 'volume_multiply'}
+
+
+@instrument.timed('volume_material')
 def volume_material(name=None, 
                       color_1=(0.523, 0, 1, 1), 
                       color_2 = (0, 0.75, 1, 1),
@@ -70,7 +518,34 @@ def volume_material(name=None,
                       multiply=.075, 
                       power=1.3,
                       divide=2.6,
-                      minimum=129):
+                      minimum=129,
+                      object_attributes=False,
+                      baked=False):
+    """
+    Volume emission material, using the shared node group of volume_node_group with
+    the given parameters. Calls with the same parameters (and name) return the same
+    material, so scenes with many volumes compile few shaders. The parameters are stored
+    on the material ('volume_params'), so a renamed material is still found, and another
+    material that took its name (e.g. after init_scene.reset_data) is not mistaken for it.
+    :param object_attributes: Read color_1, color_2 and multiply from custom properties
+        of each object instead (see set_volume_attributes), so one material can serve
+        differently tinted volumes.
+    :param baked: Read emission strength and ramp position from the grids of
+        vdb_io.shading_fields (export with fields=vdb_io.shading_fields(power, minimum, divide)),
+        leaving a multiply and the ramp per volume step. power, minimum and divide are
+        then those of the export, and unused here.
+    """
+
+    key = repr((name, tuple(color_1), tuple(color_2), pos_1, pos_2, multiply, power, divide,
+                minimum, object_attributes, baked))
+    material = bpy.data.materials.get(_material_cache.get(key, ''))
+    if material is None or material.get('volume_params') != key:
+        material = next((m for m in bpy.data.materials if m.get('volume_params') == key), None)
+    if material is not None:
+        _material_cache[key] = material.name
+        instrument.count('material_cache_hits')
+        return material
+    instrument.count('materials_built')
 
     if name is None:
         name = 'VolumeMaterial'
@@ -81,73 +556,52 @@ def volume_material(name=None,
                 i += 1
             name = name + str(i)
 
-    material = bpy.data.materials.new(name="VolumeShader")
+    material = bpy.data.materials.new(name=name)
+    material['volume_params'] = key
     material.use_nodes = True
     nodes = material.node_tree.nodes
 
     # Clear default nodes
     nodes.clear()
 
-    # Create Volume Info node
-    volume_info = nodes.new(type='ShaderNodeVolumeInfo')
-    volume_info.location = (-800, 0)
-
-    # Create Math node (set to 'POWER')
-    power_node = nodes.new(type='ShaderNodeMath')
-    power_node.operation = 'POWER'
-    power_node.inputs[1].default_value = power # Threshold value
-    power_node.location = (-600, 0)
-
-    # minimum node
-    minimum_node = nodes.new(type='ShaderNodeMath')
-    minimum_node.operation = 'MINIMUM'
-    minimum_node.inputs[1].default_value = minimum
-    minimum_node.location = (-400, 0)
-
-
-    # Create Math node (set to 'MULTIPLY')
-    multiply_node = nodes.new(type='ShaderNodeMath')
-    multiply_node.operation = 'MULTIPLY'
-    multiply_node.inputs[1].default_value = multiply  # Multiply value
-    multiply_node.location = (-200, 0)
-
-    # Create Math node (set to 'DIVIDE')
-    divide_node = nodes.new(type='ShaderNodeMath')
-    divide_node.operation = 'DIVIDE'
-    divide_node.inputs[1].default_value = divide  # Divide value
-    divide_node.location = (-470, -300)
-
-    # create coloramp node with two colors 
-    color_ramp_node = nodes.new(type='ShaderNodeValToRGB')
-    color_ramp_node.color_ramp.elements[0].color = (0,0,0,1)  
-    color_ramp_node.color_ramp.elements[0].position = 0
-    color_ramp_node.color_ramp.elements[1].color = color_1
-    color_ramp_node.color_ramp.elements[1].position = pos_1
-    # color ramp new element 
-    color_ramp_node.color_ramp.elements.new(pos_2)
-    color_ramp_node.color_ramp.elements[2].color = color_2
-
-    color_ramp_node.location = (-270, -300)
-
-    # Create Principled Volume node
-    principled_volume = nodes.new(type='ShaderNodeVolumePrincipled')
-    principled_volume.inputs['Density'].default_value = 0
-    principled_volume.location = (0, 0)
+    group_node = nodes.new(type='ShaderNodeGroup')
+    group_node.node_tree = volume_node_group(baked)
+    group_node.location = (0, 0)
+
+    for socket_name, value in [('Power', power),
+                               ('Minimum', minimum),
+                               ('Multiply', multiply),
+                               ('Divide', divide),
+                               ('Color 1', color_1),
+                               ('Color 2', color_2),
+                               ('Position 1', pos_1),
+                               ('Position 2', pos_2)]:
+        if socket_name in group_node.inputs:
+            group_node.inputs[socket_name].default_value = value
+
+    if object_attributes:
+        for i, (socket_name, attribute_name) in enumerate(OBJECT_ATTRIBUTES.items()):
+            attribute_node = nodes.new(type='ShaderNodeAttribute')
+            attribute_node.attribute_type = 'OBJECT'
+            attribute_node.attribute_name = attribute_name
+            attribute_node.location = (-300, -150 * i)
+            output = 'Color' if socket_name.startswith('Color') else 'Fac'
+            material.node_tree.links.new(attribute_node.outputs[output], group_node.inputs[socket_name])
 
     # Create Material Output node
     material_output = nodes.new(type='ShaderNodeOutputMaterial')
     material_output.location = (300, 0)
+    material.node_tree.links.new(group_node.outputs['Volume'], material_output.inputs['Volume'])
 
-    # Link nodes together
-    links = material.node_tree.links
-    links.new(volume_info.outputs['Density'], power_node.inputs[0])
-    links.new(power_node.outputs[0], minimum_node.inputs[0])
-    links.new(minimum_node.outputs[0], multiply_node.inputs[0])
-    links.new(multiply_node.outputs[0], principled_volume.inputs['Emission Strength'])
-    links.new(principled_volume.outputs['Volume'], material_output.inputs['Volume'])
+    _material_cache[key] = material.name
+
+    return material
 
-    links.new(volume_info.outputs['Density'], divide_node.inputs[0])
-    links.new(divide_node.outputs[0], color_ramp_node.inputs['Fac'])
-    links.new(color_ramp_node.outputs['Color'], principled_volume.inputs['Emission Color'])
 
-    return material
\ No newline at end of file
+def set_volume_attributes(vol_obj, color_1=(0.523, 0, 1, 1), color_2=(0, 0.75, 1, 1),
+                          multiply=.075):
+    """
+    Sets the per-object parameters read by a volume_material made with object_attributes=True.
+    """
+    for attribute_name, value in zip(OBJECT_ATTRIBUTES.values(), [color_1, color_2, multiply]):
+        vol_obj[attribute_name] = value
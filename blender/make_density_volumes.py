@@ -33,17 +33,20 @@ volume_obj_2 = lblut.make_volume(path_vdb,
                                center_location=(-2.5,0,0),
                                name='density_2')
 
-volume_material_1 = lblut.volume_material(color_1=(1,0,0, 1),
-                                          color_2=(1,1,1,1),
-                                          multiply=1,
-                                          divide=0.9)
-volume_obj_1.data.materials.append(volume_material_1)
-
-volume_material_2 = lblut.volume_material(color_1=(0,1,0, 1),
-                                          color_2=(1,1,1,1),
-                                          multiply=1,
-                                          divide=0.9)
-volume_obj_2.data.materials.append(volume_material_2)
+# One material for both volumes, tinted per object through custom properties
+volume_material = lblut.volume_material(divide=0.9, object_attributes=True)
+
+lblut.set_material(volume_obj_1, volume_material)
+lblut.set_volume_attributes(volume_obj_1, 
+                            color_1=(1,0,0, 1),
+                            color_2=(1,1,1,1),
+                            multiply=1)
+
+lblut.set_material(volume_obj_2, volume_material)
+lblut.set_volume_attributes(volume_obj_2, 
+                            color_1=(0,1,0, 1),
+                            color_2=(1,1,1,1),
+                            multiply=1)
 
 
 # set camera
@@ -0,0 +1,344 @@
+"""
+Headless render jobs: a parameter grid (volume files, cameras of set_camera, set_cycles or
+set_eevee settings, frame ranges...) is expanded into jobs, which run on a bounded pool
+of worker processes with retries, per-job timeouts and a progress file, so an interrupted
+run resumes with the jobs not done yet. Jobs are rendered by a renderer backend:
+BlenderRenderer runs each job in a background Blender (blender -b), FakeRenderer writes
+placeholder files, to try out the scheduling on a machine without Blender or a GPU.
+
+    python render_jobs.py jobs.json renders/ [--workers=2] [--retries=2] [--timeout=600] [--blender=blender] [--fake]
+
+jobs.json holds {"grid": {parameter: [values]}, "common": {parameter: value}} (see expand_jobs).
+"""
+import os
+import sys
+import glob
+import json
+import time
+import queue
+import signal
+import hashlib
+import itertools
+import subprocess
+import multiprocessing as mp
+from abc import ABC, abstractmethod
+from collections import deque
+
+
+def job_id(job):
+    """
+    Stable id of a job, from its parameters (so resumed runs recognize their jobs).
+    """
+    params = {key: value for key, value in job.items() if key != 'id'}
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def expand_jobs(grid, **common):
+    """
+    One job per combination of the values of grid, with the common parameters added.
+    Job parameters (all optional but 'volume'), as used by render_job:
+        'volume': .vdb file, or glob pattern of a sequence (see local_blutils.VolumeSequence)
+        'volume_options': options of make_volume / VolumeSequence (resolution, scale...)
+        'material': options of volume_material
+        'camera': arguments of set_camera, e.g. {'position': (0, 30, 0), 'focal_length': 60}
+        'engine': 'cycles' or 'eevee', 'settings': arguments of set_cycles / set_eevee
+        'frames': (first, last) frames, 'resolution': (x, y)
+
+        jobs = expand_jobs({'volume': ['density.vdb'],
+                            'camera': [{'position': (0, 30, 0)}, {'position': (30, 0, 0)}],
+                            'settings': [{'render_samples': 16}, {'render_samples': 64}]},
+                           engine='cycles', frames=(1, 1))
+    :return: List of jobs (dicts), each with its 'id'.
+    """
+    keys = list(grid)
+    jobs = []
+    for values in itertools.product(*(grid[key] for key in keys)):
+        # Through JSON, so jobs are the same whether made here or read from the progress file
+        job = json.loads(json.dumps(dict(common, **dict(zip(keys, values)))))
+        job['id'] = job_id(job)
+        jobs.append(job)
+    return jobs
+
+
+class Renderer(ABC):
+    """
+    Renderer backend of run_jobs. render is called in a worker process, and should raise
+    an exception if the job failed.
+    """
+
+    @abstractmethod
+    def render(self, job, output_dir):
+        """
+        Renders job into output_dir.
+        :return: List of output files.
+        """
+
+
+class BlenderRenderer(Renderer):
+    """
+    Renders each job in its own background Blender process, running render_job.
+    """
+
+    def __init__(self, blender='blender', gpu=None):
+        """
+        :param blender: Blender executable.
+        :param gpu: Overrides the gpu option of set_cycles for every job if not None.
+        """
+        self.blender = blender
+        self.gpu = gpu
+
+    def render(self, job, output_dir):
+        if self.gpu is not None:
+            job = dict(job, settings=dict(job.get('settings', {}), gpu=self.gpu))
+
+        # Without --python-exit-code, Blender exits with 0 even if render_job raised
+        command = [self.blender, '-b', '--python-exit-code', '1', '--python', os.path.abspath(__file__),
+                   '--', '--render-job=' + json.dumps(job), output_dir]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f'Blender exited with code {result.returncode}: {result.stderr[-2000:]}')
+
+        return sorted(glob.glob(os.path.join(output_dir, job['id'], '*')))
+
+
+class FakeRenderer(Renderer):
+    """
+    Writes one small text file per frame instead of rendering, taking `seconds` per frame.
+    The first `failures` attempts of each job fail (attempts are counted with a marker
+    file), to exercise retries; a large `seconds` exercises timeouts.
+    """
+
+    def __init__(self, seconds=0.01, failures=0):
+        self.seconds = seconds
+        self.failures = failures
+
+    def render(self, job, output_dir):
+        folder = os.path.join(output_dir, job['id'])
+        os.makedirs(folder, exist_ok=True)
+
+        marker = os.path.join(folder, 'attempts')
+        attempts = int(open(marker).read()) if os.path.exists(marker) else 0
+        with open(marker, 'w') as f:
+            f.write(str(attempts + 1))
+        if attempts < self.failures:
+            raise RuntimeError(f'Simulated failure {attempts + 1} of job {job["id"]}')
+
+        first, last = job.get('frames', (1, 1))
+        outputs = []
+        for frame in range(first, last + 1):
+            time.sleep(self.seconds)
+            path = os.path.join(folder, f'{frame:04d}.txt')
+            with open(path, 'w') as f:
+                json.dump(dict(job, frame=frame), f)
+            outputs.append(path)
+
+        return outputs
+
+
+def _attempt(renderer, job, attempt, output_dir, results):
+    """
+    Worker process: one attempt of a job, reported as (id, attempt, outputs, error, seconds).
+    The worker leads its own process group, so the processes started by the renderer
+    (e.g. Blender) are killed with it (see _kill).
+    """
+    if hasattr(os, 'setsid'):
+        os.setsid()
+
+    start = time.perf_counter()
+    try:
+        outputs = renderer.render(job, output_dir)
+        if not outputs:
+            raise RuntimeError('The renderer wrote no output files.')
+        results.put((job['id'], attempt, outputs, None, time.perf_counter() - start))
+    except Exception as error:
+        results.put((job['id'], attempt, None, f'{type(error).__name__}: {error}',
+                     time.perf_counter() - start))
+
+
+def _kill(process):
+    """
+    Kills a worker process and its process group (the renderer's child processes).
+    """
+    if hasattr(os, 'killpg'):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    process.kill()
+
+
+def process_context():
+    """
+    Multiprocessing context of the worker processes (also used by batch_convert): 'fork'
+    where available, so workers inherit what they need instead of receiving it pickled.
+    """
+    if 'fork' in mp.get_all_start_methods():
+        return mp.get_context('fork')
+    return mp.get_context()
+
+
+def load_state(state_path):
+    """
+    Progress of a run, {job id: entry}, each entry with 'job', 'status' ('done' or
+    'failed'), 'attempts', 'seconds', and 'outputs' or 'error'.
+    """
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def _save_state(state, state_path):
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(state_path + '.tmp', state_path)
+
+
+def run_jobs(jobs, renderer, output_dir, workers=2, retries=2, timeout=None, state_path=None):
+    """
+    Runs jobs on up to workers processes at once, each attempt in its own process, so a
+    job that hangs or crashes is killed or detected without stopping the others. Failed
+    or timed out jobs are retried up to retries times. Progress is saved after every job
+    to state_path, and jobs already done there are skipped, so re-running resumes (jobs
+    that failed are tried again).
+    :param jobs: Jobs of expand_jobs.
+    :param renderer: Renderer backend (BlenderRenderer, FakeRenderer...).
+    :param timeout: Seconds after which an attempt is killed (no limit if None).
+    :param state_path: Progress file (output_dir/state.json if None).
+    :return: The state, {job id: entry} (see load_state).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if state_path is None:
+        state_path = os.path.join(output_dir, 'state.json')
+    state = load_state(state_path)
+
+    pending = deque(job for job in jobs if state.get(job['id'], {}).get('status') != 'done')
+    print(f'Rendering {len(pending)} of {len(jobs)} jobs')
+    if not pending:
+        return state
+
+    # Forked workers inherit the renderer, so it needs not be picklable
+    context = process_context()
+    results = context.Queue()
+
+    attempts = {}
+    running = {}  # job id: (process, job, attempt, start)
+    start = time.perf_counter()
+
+    while pending or running:
+        while pending and len(running) < workers:
+            job = pending.popleft()
+            attempts[job['id']] = attempts.get(job['id'], 0) + 1
+            process = context.Process(target=_attempt, daemon=True,
+                                      args=(renderer, job, attempts[job['id']], output_dir, results))
+            process.start()
+            running[job['id']] = (process, job, attempts[job['id']], time.perf_counter())
+
+        finished = []
+        try:
+            finished.append(results.get(timeout=0.1))
+            while True:
+                finished.append(results.get_nowait())
+        except queue.Empty:
+            pass
+
+        # Reports of attempts that were already given up on (e.g. killed at the timeout) are stale
+        finished = [report for report in finished
+                    if report[0] in running and running[report[0]][2] == report[1]]
+        reported = [report[0] for report in finished]
+
+        now = time.perf_counter()
+        for id_, (process, job, attempt, started) in running.items():
+            if id_ in reported:
+                continue
+            if timeout is not None and now - started > timeout:
+                _kill(process)
+                finished.append((id_, attempt, None, f'Timed out after {timeout} s', now - started))
+            elif not process.is_alive() and process.exitcode != 0:
+                _kill(process)
+                finished.append((id_, attempt, None, f'Worker exited with code {process.exitcode}',
+                                 now - started))
+
+        for id_, attempt, outputs, error, seconds in finished:
+            process, job = running.pop(id_)[:2]
+            process.join()
+
+            if error is None:
+                state[id_] = {'job': job, 'status': 'done', 'attempts': attempt, 'seconds': seconds,
+                              'outputs': outputs}
+                print(f'Job {id_} done in {seconds:.1f} s')
+            elif attempt <= retries:
+                print(f'Job {id_} failed ({error}), retrying')
+                pending.append(job)
+                continue
+            else:
+                state[id_] = {'job': job, 'status': 'failed', 'attempts': attempt, 'seconds': seconds,
+                              'error': error}
+                print(f'Job {id_} failed after {attempt} attempts: {error}')
+            _save_state(state, state_path)
+
+    done = sum(entry['status'] == 'done' for entry in state.values())
+    print(f'{done} of {len(state)} jobs done, {time.perf_counter() - start:.1f} s')
+
+    return state
+
+
+def render_job(job, output_dir):
+    """
+    Builds the scene of a job and renders its frames to output_dir/<job id>/ (run within
+    Blender, see BlenderRenderer).
+    """
+    import bpy
+    import local_blutils as lblut
+    from init_scene import Scene, set_camera
+
+    first, last = job.get('frames', (1, 1))
+    scene = Scene(clean=True, alpha=job.get('alpha', 0), frame_start=first, frame_end=last)
+    scene.render(resolution=job.get('resolution', (720, 720)))
+
+    if job.get('engine', 'cycles') == 'cycles':
+        scene.set_cycles(**job.get('settings', {}))
+    else:
+        scene.set_eevee(**job.get('settings', {}))
+
+    if '*' in job['volume']:
+        vol_obj = lblut.VolumeSequence(job['volume'], frame_start=first, **job.get('volume_options', {})).vol_obj
+    else:
+        vol_obj = lblut.make_volume(job['volume'], **job.get('volume_options', {}))
+    lblut.set_material(vol_obj, lblut.volume_material(**job.get('material', {})))
+
+    camera = set_camera(**job.get('camera', {'position': (0, 30, 0)}))
+    bpy.context.scene.camera = camera
+
+    bpy.context.scene.render.filepath = os.path.join(output_dir, job['id'], '')
+    bpy.ops.render.render(animation=True)
+
+
+if __name__ == '__main__':
+    options = dict(arg[2:].split('=', 1) if '=' in arg else (arg[2:], True)
+                   for arg in sys.argv[1:] if arg.startswith('--') and arg != '--')
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+
+    if 'render-job' in options:
+        # Within Blender: blender -b --python render_jobs.py -- --render-job=<job> <output_dir>
+        sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+        render_job(json.loads(options['render-job']), args[-1])
+        sys.exit(0)
+
+    if len(args) != 2:
+        print(__doc__)
+        sys.exit(1)
+
+    with open(args[0]) as f:
+        spec = json.load(f)
+    jobs = expand_jobs(spec['grid'], **spec.get('common', {}))
+
+    if 'fake' in options:
+        renderer = FakeRenderer()
+    else:
+        renderer = BlenderRenderer(options.get('blender', 'blender'))
+
+    state = run_jobs(jobs, renderer, args[1], workers=int(options.get('workers', 2)),
+                     retries=int(options.get('retries', 2)),
+                     timeout=float(options['timeout']) if 'timeout' in options else None)
+    sys.exit(0 if all(entry['status'] == 'done' for entry in state.values()) else 1)
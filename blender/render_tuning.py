@@ -0,0 +1,132 @@
+"""
+Render settings for volumes derived from the statistics of the exported grid (voxel
+size, active bounding box, occupancy, density histogram). Everything is computed with
+NumPy (see vdb_io), so settings can be chosen without Blender; Scene.set_volume_settings
+applies them.
+
+    python render_tuning.py density.vdb [world size of a voxel] [step budget]
+"""
+import sys
+
+import numpy as np
+
+import vdb_io
+
+# Values below this fraction of the maximum barely show, and are not counted as filled
+SIGNIFICANT = 0.01
+
+EEVEE_TILE_SIZES = [1, 2, 4, 8, 16]
+
+
+def grid_stats(filepath, name='density', bins=64):
+    """
+    Statistics of a grid of a .vdb file, from its leaves (no dense array is built).
+    :return: Dictionary with 'voxel_size', 'bbox' (lo, hi) index ranges of the active voxels
+        (hi exclusive), 'active_voxels', 'occupancy' (active fraction of the bounding box),
+        'significant_occupancy' (fraction above SIGNIFICANT times the maximum), 'max', 'mean',
+        'percentiles' (50, 90, 99) and 'histogram' (counts, edges) of the active values.
+    """
+    grid = vdb_io.read_vdb(filepath)[name]
+
+    masks = grid['masks'].reshape(-1, vdb_io.LEAF_DIM, vdb_io.LEAF_DIM, vdb_io.LEAF_DIM)
+    values = grid['values'][grid['masks']]
+    weights = np.ones(len(values))
+
+    # Bounding box of the active voxels of each leaf, along each axis
+    los, his = [], []
+    for axis in range(3):
+        other = tuple(a + 1 for a in range(3) if a != axis)
+        active = masks.any(axis=other)
+        los.append(np.argmax(active, axis=1))
+        his.append(vdb_io.LEAF_DIM - np.argmax(active[:, ::-1], axis=1))
+    keep = masks.reshape(len(masks), -1).any(axis=1)
+    lo = (grid['origins'] + np.stack(los, axis=1))[keep]
+    hi = (grid['origins'] + np.stack(his, axis=1))[keep]
+
+    for origin, size, value in grid['tiles']:
+        lo = np.vstack([lo, origin])
+        hi = np.vstack([hi, np.asarray(origin) + size])
+        values = np.append(values, value)
+        weights = np.append(weights, size**3)
+
+    if not len(values):
+        raise ValueError(f'Grid {name} of {filepath} has no active voxels.')
+
+    bbox = (lo.min(axis=0), hi.max(axis=0))
+    bbox_voxels = np.prod(bbox[1] - bbox[0])
+    max_val = values.max()
+    counts, edges = np.histogram(values, bins=bins, range=(0, max_val), weights=weights)
+
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order]) / weights.sum()
+    percentiles = values[order][np.searchsorted(cumulative, [0.5, 0.9, 0.99])]
+
+    return {'voxel_size': grid['transform']['voxel_size'],
+            'bbox': bbox,
+            'active_voxels': int(weights.sum()),
+            'occupancy': weights.sum() / bbox_voxels,
+            'significant_occupancy': weights[values > SIGNIFICANT * max_val].sum() / bbox_voxels,
+            'max': max_val,
+            'mean': np.average(values, weights=weights),
+            'percentiles': percentiles,
+            'histogram': (counts, edges)}
+
+
+def volume_settings(stats, object_scale=1.0, step_budget=256, quality=1.0, pixel_size=None):
+    """
+    Cycles and EEVEE volume settings for a grid.
+
+    Cycles marches rays through volume objects in steps of volume_step_rate voxels. A ray
+    through the filled part of the grid crosses about chord = diagonal * occupancy^(1/3)
+    voxels (diagonal of the active bounding box, occupancy of the values that show), so
+    the step rate is the finest one keeping the steps below step_budget (which sets the
+    render time), but not finer than 1 / quality voxels, nor so coarse that the filled part
+    gets fewer than 16 steps (which shows as banding). volume_max_steps is set to cross the
+    whole diagonal, so rays are never cut short.
+    EEVEE's tile size is the largest one not larger than a voxel on screen, and its samples
+    (depth slices) are the steps through the diagonal.
+
+    :param stats: Statistics of grid_stats.
+    :param object_scale: World size of one index unit of the grid (scale / resolution in make_volume).
+    :param step_budget: Target number of steps through the filled part of the volume.
+    :param quality: Steps per voxel at most (1 resolves every voxel).
+    :param pixel_size: World size of a pixel at the volume (see local_blutils.pixel_size),
+        for the EEVEE tile size. If None, EEVEE's default tile size (8) is kept.
+    """
+    lo, hi = stats['bbox']
+    diagonal = np.linalg.norm(hi - lo)
+    chord = diagonal * stats['significant_occupancy']**(1 / 3)
+
+    step_rate = max(chord / step_budget, 1 / quality)
+    step_rate = min(step_rate, max(chord / 16, 1 / quality))
+    max_steps = int(np.ceil(diagonal / step_rate)) + 1
+
+    tile_size = 8
+    if pixel_size is not None:
+        voxel_pixels = np.mean(stats['voxel_size']) * object_scale / pixel_size
+        tile_size = max([size for size in EEVEE_TILE_SIZES if size <= voxel_pixels], default=1)
+
+    samples = int(np.clip(np.ceil(diagonal / step_rate), 16, 256))
+
+    return {'volume_step_rate': step_rate,
+            'volume_preview_step_rate': 4 * step_rate,
+            'volume_max_steps': max_steps,
+            'volumetric_tile_size': tile_size,
+            'volumetric_samples': samples,
+            'estimated_steps': float(chord / step_rate)}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    stats = grid_stats(sys.argv[1])
+    lo, hi = stats['bbox']
+    print(f'Active bounding box {lo} - {hi}, {stats["active_voxels"]} active voxels, '
+          f'occupancy {stats["occupancy"]:.3f} ({stats["significant_occupancy"]:.3f} significant)')
+
+    object_scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    step_budget = float(sys.argv[3]) if len(sys.argv) > 3 else 256
+    for key, value in volume_settings(stats, object_scale, step_budget).items():
+        print(f'{key} = {value:.4g}')
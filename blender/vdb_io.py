@@ -0,0 +1,855 @@
+"""
+Reading and writing of OpenVDB files with NumPy only, without pyopenvdb, so .vdb files
+can be generated on any machine (not just within the Blender Python environment).
+Supports float grids (Tree_float_5_4_3), as used by Blender volumes.
+
+    python vdb_io.py density.npy density.vdb [--half] [--no-compress] [--crop] [--lods=3] [--fields]
+
+--fields also writes the 'emission' and 'ramp' grids of shading_fields (default parameters).
+"""
+import io
+import os
+import sys
+import struct
+import tempfile
+import uuid
+import zlib
+
+import numpy as np
+
+from instrumentation import instrument
+
+MAGIC = 0x56444220
+FILE_VERSION = 224
+LIBRARY_VERSION = (10, 0)
+
+COMPRESS_NONE = 0
+COMPRESS_ZIP = 0x1
+COMPRESS_ACTIVE_MASK = 0x2
+COMPRESS_BLOSC = 0x4
+
+# Per-node value compression metadata (see openvdb/io/Compression.h)
+NO_MASK_OR_INACTIVE_VALS = 0
+NO_MASK_AND_MINUS_BG = 1
+NO_MASK_AND_ONE_INACTIVE_VAL = 2
+MASK_AND_NO_INACTIVE_VALS = 3
+MASK_AND_ONE_INACTIVE_VAL = 4
+MASK_AND_TWO_INACTIVE_VALS = 5
+NO_MASK_AND_ALL_VALS = 6
+
+GRID_TYPE = 'Tree_float_5_4_3'
+HALF_SUFFIX = '_HalfFloat'
+
+# Log2 of the node dimensions: leaf (8^3 voxels), lower (16^3 leaves), upper (32^3 lower nodes).
+LEAF_LOG2, LOWER_LOG2, UPPER_LOG2 = 3, 4, 5
+LEAF_DIM = 1 << LEAF_LOG2
+LOWER_DIM = LEAF_DIM << LOWER_LOG2
+UPPER_DIM = LOWER_DIM << UPPER_LOG2
+LEAF_SIZE = LEAF_DIM**3
+
+
+class LeafSpool:
+    """
+    Collects the non-empty 8^3 leaves of one grid. Leaf buffers (value mask and values)
+    are encoded as they are added and spooled to a temporary file, so only the leaf
+    origins and buffer offsets stay in memory.
+    """
+
+    def __init__(self, name='density', half=False, compress=True):
+        self.name = name
+        self.half = half
+        self.compress = compress
+        self.origins = []
+        self.offsets = []
+        self.file = tempfile.SpooledTemporaryFile(max_size=1 << 28)
+        self.voxel_count = 0
+        self.bbox_min = np.full(3, np.iinfo(np.int32).max, dtype=np.int64)
+        self.bbox_max = np.full(3, np.iinfo(np.int32).min, dtype=np.int64)
+
+    def __len__(self):
+        return sum(len(o) for o in self.origins)
+
+    def add_array(self, array, ijk=(0, 0, 0), norm=1.0, threshold=0.0, slab_leaves=1, derived=()):
+        """
+        Adds the voxels of a dense array, placing array[0, 0, 0] at index ijk. Voxels equal
+        to zero (the background) are inactive, and leaves without active voxels are skipped.
+        Values are divided by norm, and if threshold > 0, values at or below it (after the
+        division) are pruned to the background. Works on memmaps: the array is read slab by slab.
+        :param derived: List of (spool, func): the same leaves are added to each spool, with
+            values func(values) on the same active voxels, so the grids share their topology.
+        """
+        ni, nj, nk = array.shape
+        oi, oj, ok = [int(v) for v in ijk]
+        pi, pj, pk = oi % LEAF_DIM, oj % LEAF_DIM, ok % LEAF_DIM
+        nbi = -(-(pi + ni) // LEAF_DIM)
+        nbj = -(-(pj + nj) // LEAF_DIM)
+        nbk = -(-(pk + nk) // LEAF_DIM)
+
+        step = LEAF_DIM * slab_leaves
+        for bi in range(0, nbi, slab_leaves):
+            start = bi * LEAF_DIM - pi
+            rows = array[max(start, 0):start + step]
+            nb = min(slab_leaves, nbi - bi)
+
+            slab = np.zeros((nb * LEAF_DIM, nbj * LEAF_DIM, nbk * LEAF_DIM), dtype=np.float32)
+            first = max(0, -start)
+            slab[first:first + len(rows), pj:pj + nj, pk:pk + nk] = np.asarray(rows, dtype=float) / norm
+            if threshold > 0:
+                slab[slab <= threshold] = 0
+
+            blocks = slab.reshape(nb, LEAF_DIM, nbj, LEAF_DIM, nbk, LEAF_DIM)
+            blocks = blocks.transpose(0, 2, 4, 1, 3, 5).reshape(-1, LEAF_SIZE)
+
+            b = np.indices((nb, nbj, nbk)).reshape(3, -1).T
+            origins = (b + [bi, 0, 0]) * LEAF_DIM + [oi - pi, oj - pj, ok - pk]
+            self.add_blocks(origins, blocks)
+
+            if derived:
+                masks = blocks != 0
+                for spool, func in derived:
+                    spool.add_blocks(origins, np.where(masks, func(blocks), 0), masks=masks)
+
+    def add_blocks(self, origins, blocks, masks=None):
+        """
+        Adds leaves given their origins (L, 3), multiples of 8, and values (L, 512) in
+        x-major order. Leaves without active voxels are skipped.
+        :param masks: Active voxels (L, 512); the non-zero values if None.
+        """
+        blocks = np.asarray(blocks, dtype=np.float32).reshape(-1, LEAF_SIZE)
+        if masks is None:
+            masks = blocks != 0
+        else:
+            masks = np.asarray(masks, dtype=bool).reshape(-1, LEAF_SIZE)
+        keep = np.flatnonzero(masks.any(axis=1))
+        if len(keep) == 0:
+            return
+        origins = np.asarray(origins, dtype=np.int32).reshape(-1, 3)[keep]
+        blocks, masks = blocks[keep], masks[keep]
+
+        self.voxel_count += int(masks.sum())
+        cube = masks.reshape(-1, LEAF_DIM, LEAF_DIM, LEAF_DIM)
+        for axis, other in enumerate([(2, 3), (1, 3), (1, 2)]):
+            extent = cube.any(axis=other)
+            lo = origins[:, axis] + extent.argmax(axis=1)
+            hi = origins[:, axis] + LEAF_DIM - 1 - extent[:, ::-1].argmax(axis=1)
+            self.bbox_min[axis] = min(self.bbox_min[axis], lo.min())
+            self.bbox_max[axis] = max(self.bbox_max[axis], hi.max())
+
+        packed_masks = np.packbits(masks, axis=1, bitorder='little')
+        values = blocks.astype(np.float16 if self.half else np.float32)
+
+        offsets = np.empty(len(keep) + 1, dtype=np.int64)
+        offsets[0] = self.file.seek(0, io.SEEK_END)
+        for n in range(len(keep)):
+            record = packed_masks[n].tobytes() + bytes([NO_MASK_AND_ALL_VALS])
+            record += _encode_values(values[n].tobytes(), self.compress)
+            offsets[n + 1] = offsets[n] + self.file.write(record)
+
+        self.origins.append(origins)
+        self.offsets.append(offsets)
+
+    def leaves(self):
+        """
+        Leaf origins and buffer record extents, in tree order.
+        """
+        if not self.origins:
+            empty = np.zeros(0, dtype=np.int64)
+            return np.zeros((0, 3), dtype=np.int64), empty, empty
+
+        origins = np.concatenate(self.origins).astype(np.int64)
+        order = _tree_order(origins)
+        starts = np.concatenate([o[:-1] for o in self.offsets])[order]
+        stops = np.concatenate([o[1:] for o in self.offsets])[order]
+
+        return origins[order], starts, stops
+
+    def read_masks(self, starts):
+        """
+        Packed value masks of the leaves whose records start at the given offsets.
+        """
+        masks = []
+        for start in starts:
+            self.file.seek(start)
+            masks.append(self.file.read(LEAF_SIZE // 8))
+        return b''.join(masks)
+
+    def copy_records(self, f, starts, stops):
+        """
+        Writes the spooled buffer records with the given extents to f, in that order.
+        """
+        for start, stop in zip(starts, stops):
+            self.file.seek(start)
+            f.write(self.file.read(stop - start))
+
+    def close(self):
+        self.file.close()
+
+
+def _tree_order(origins):
+    """
+    Order in which leaves are stored: by upper node (sorted by origin), then by lower
+    node and leaf offsets within their parents.
+    """
+    upper = origins & ~(UPPER_DIM - 1)
+    lower_index = _child_index(origins, UPPER_DIM, LOWER_DIM, UPPER_LOG2)
+    leaf_index = _child_index(origins, LOWER_DIM, LEAF_DIM, LOWER_LOG2)
+    return np.lexsort((leaf_index, lower_index, upper[:, 2], upper[:, 1], upper[:, 0]))
+
+
+def _child_index(origins, node_dim, child_dim, log2):
+    """
+    Linear offset of the child containing each origin within its parent node.
+    """
+    local = (origins & (node_dim - 1)) // child_dim
+    return (local[:, 0] << (2 * log2)) + (local[:, 1] << log2) + local[:, 2]
+
+
+def _encode_values(data, compress):
+    """
+    Value buffer as written by io::writeData: raw, or zlib with an int64 size prefix
+    (negative when the data is stored uncompressed).
+    """
+    if not compress:
+        return data
+    zipped = zlib.compress(data)
+    if len(zipped) < len(data):
+        return struct.pack('<q', len(zipped)) + zipped
+    return struct.pack('<q', -len(data)) + data
+
+
+def _write_string(f, s):
+    data = s.encode()
+    f.write(struct.pack('<I', len(data)) + data)
+
+
+def _write_metadata(f, metadata):
+    f.write(struct.pack('<i', len(metadata)))
+    for name, (type_name, value) in sorted(metadata.items()):
+        if type_name == 'string':
+            data = value.encode()
+        elif type_name == 'bool':
+            data = struct.pack('<?', value)
+        elif type_name == 'vec3i':
+            data = struct.pack('<3i', *value)
+        elif type_name == 'vec3d':
+            data = struct.pack('<3d', *value)
+        elif type_name == 'int64':
+            data = struct.pack('<q', value)
+        elif type_name == 'float':
+            data = struct.pack('<f', value)
+        else:
+            raise ValueError(f'Unsupported metadata type {type_name}.')
+        _write_string(f, name)
+        _write_string(f, type_name)
+        f.write(struct.pack('<I', len(data)) + data)
+
+
+def _write_transform(f, voxel_size=1.0, translation=(0, 0, 0)):
+    """
+    Linear index-to-world transform, stored as a (Uniform)Scale(Translate)Map.
+    """
+    scale = np.broadcast_to(np.asarray(voxel_size, dtype=float), 3)
+    translation = np.asarray(translation, dtype=float)
+
+    map_type = 'UniformScale' if np.all(scale == scale[0]) else 'Scale'
+    map_type += 'TranslateMap' if np.any(translation != 0) else 'Map'
+    _write_string(f, map_type)
+
+    if map_type.endswith('TranslateMap'):
+        f.write(translation.astype('<f8').tobytes())
+    for values in [scale, np.abs(scale), 1 / scale, 1 / scale**2, 0.5 / scale]:
+        f.write(values.astype('<f8').tobytes())
+
+
+def _write_topology(f, spool, origins, starts):
+    """
+    Tree topology: root with one child per upper node, internal node masks and (all
+    inactive, zero) values, and the value mask of every leaf.
+    """
+    value_type = np.float16 if spool.half else np.float32
+    upper_values = _encode_values(np.zeros(1 << (3 * UPPER_LOG2), value_type).tobytes(), spool.compress)
+    lower_values = _encode_values(np.zeros(1 << (3 * LOWER_LOG2), value_type).tobytes(), spool.compress)
+    upper_empty = bytes(1 << (3 * UPPER_LOG2 - 3))
+    lower_empty = bytes(1 << (3 * LOWER_LOG2 - 3))
+
+    uppers = origins & ~(UPPER_DIM - 1)
+    lowers = origins & ~(LOWER_DIM - 1)
+    lower_index = _child_index(origins, UPPER_DIM, LOWER_DIM, UPPER_LOG2)
+    leaf_index = _child_index(origins, LOWER_DIM, LEAF_DIM, LOWER_LOG2)
+
+    # Leaves are already in tree order, so every node is a contiguous run of them.
+    upper_starts = _run_starts(uppers)
+    lower_starts = _run_starts(lowers)
+
+    f.write(struct.pack('<i', 1))  # Buffer count
+    f.write(struct.pack('<f', 0.0))  # Background
+    f.write(struct.pack('<II', 0, len(upper_starts) - 1))  # Root tiles and children
+
+    for u in range(len(upper_starts) - 1):
+        u0, u1 = upper_starts[u], upper_starts[u + 1]
+        f.write(uppers[u0].astype('<i4').tobytes())
+
+        child_lowers = lower_starts[(lower_starts >= u0) & (lower_starts < u1)]
+        f.write(_mask_bytes(lower_index[child_lowers], UPPER_LOG2))
+        f.write(upper_empty + bytes([NO_MASK_AND_ALL_VALS]) + upper_values)
+
+        for l0 in child_lowers:
+            l1 = lower_starts[np.searchsorted(lower_starts, l0, side='right')]
+            f.write(_mask_bytes(leaf_index[l0:l1], LOWER_LOG2))
+            f.write(lower_empty + bytes([NO_MASK_AND_ALL_VALS]) + lower_values)
+
+            # Leaf topology is just the value mask.
+            f.write(spool.read_masks(starts[l0:l1]))
+
+
+def _run_starts(keys):
+    """
+    Start of every run of equal rows in keys, followed by len(keys).
+    """
+    if len(keys) == 0:
+        # No runs (a grid without leaves)
+        return np.zeros(1, dtype=np.int64)
+    change = np.any(keys[1:] != keys[:-1], axis=1)
+    return np.concatenate([[0], np.flatnonzero(change) + 1, [len(keys)]])
+
+
+def _mask_bytes(indices, log2):
+    bits = np.zeros(1 << (3 * log2), dtype=bool)
+    bits[indices] = True
+    return np.packbits(bits, bitorder='little').tobytes()
+
+
+def write_vdb(filepath, spools, voxel_size=1.0, translation=(0, 0, 0), metadata=None):
+    """
+    Writes one or more grids, given as LeafSpool objects, to a .vdb file.
+    :param voxel_size: Voxel size of the index-to-world transform (scalar or three values).
+    :param translation: World position of voxel (0, 0, 0).
+    :param metadata: Extra grid metadata, {name: (type_name, value)}.
+    """
+    if isinstance(spools, LeafSpool):
+        spools = [spools]
+
+    with open(filepath, 'wb') as f:
+        f.write(struct.pack('<qIII', MAGIC, FILE_VERSION, *LIBRARY_VERSION))
+        f.write(b'\x01')  # Has grid offsets
+        f.write(str(uuid.uuid4()).encode())
+        _write_metadata(f, {})
+        f.write(struct.pack('<i', len(spools)))
+
+        for spool in spools:
+            _write_grid(f, spool, voxel_size, translation, metadata or {})
+
+
+def _write_grid(f, spool, voxel_size, translation, metadata):
+    grid_type = GRID_TYPE + (HALF_SUFFIX if spool.half else '')
+    _write_string(f, spool.name)
+    _write_string(f, grid_type)
+    _write_string(f, '')  # Instance parent
+
+    offsets_pos = f.tell()
+    f.write(bytes(24))
+    grid_pos = f.tell()
+
+    f.write(struct.pack('<I', COMPRESS_ZIP if spool.compress else COMPRESS_NONE))
+
+    grid_meta = {
+        'class': ('string', 'fog volume'),
+        'name': ('string', spool.name),
+        'file_compression': ('string', 'zip' if spool.compress else 'none'),
+        'is_saved_as_half_float': ('bool', spool.half),
+        'file_voxel_count': ('int64', spool.voxel_count),
+    }
+    if spool.voxel_count:
+        grid_meta['file_bbox_min'] = ('vec3i', spool.bbox_min.tolist())
+        grid_meta['file_bbox_max'] = ('vec3i', spool.bbox_max.tolist())
+    grid_meta.update(metadata)
+    _write_metadata(f, grid_meta)
+    _write_transform(f, voxel_size, translation)
+
+    origins, starts, stops = spool.leaves()
+    _write_topology(f, spool, origins, starts)
+
+    block_pos = f.tell()
+    spool.copy_records(f, starts, stops)
+    end_pos = f.tell()
+
+    f.seek(offsets_pos)
+    f.write(struct.pack('<qqq', grid_pos, block_pos, end_pos))
+    f.seek(end_pos)
+
+
+def iter_tiles(shape, tile=128, ijk=(0, 0, 0)):
+    """
+    Slices splitting an array of the given shape into tiles of about tile^3 voxels.
+    Tile bounds fall on leaf boundaries of the index space (with array[0, 0, 0] at ijk),
+    so no leaf is split between tiles. tile must be a multiple of 8.
+    """
+    if tile % LEAF_DIM:
+        raise ValueError(f'Tile size must be a multiple of {LEAF_DIM}.')
+
+    bounds = []
+    for n, offset in zip(shape, ijk):
+        first = (-offset) % LEAF_DIM
+        inner = [b for b in range(first, n, tile) if b > 0]
+        bounds.append([0] + inner + [n])
+
+    for i0, i1 in zip(bounds[0][:-1], bounds[0][1:]):
+        for j0, j1 in zip(bounds[1][:-1], bounds[1][1:]):
+            for k0, k1 in zip(bounds[2][:-1], bounds[2][1:]):
+                yield (slice(i0, i1), slice(j0, j1), slice(k0, k1))
+
+
+def tiled_nanmax(array, tile=128):
+    """
+    np.nanmax computed tile by tile, so a memmap is streamed instead of loaded.
+    """
+    max_val = -np.inf
+    for tile_slices in iter_tiles(array.shape, tile):
+        values = array[tile_slices]
+        if values.size and not np.all(np.isnan(values)):
+            max_val = max(max_val, np.nanmax(values))
+    return max_val
+
+
+def active_bbox(array, threshold=0.0, tile=128):
+    """
+    Tight bounding box of the voxels above threshold, found tile by tile.
+    Returns the index ranges (lo, hi), with hi exclusive, or None if no voxel is above threshold.
+    """
+    lo = np.full(3, np.iinfo(np.int64).max)
+    hi = np.full(3, -1)
+    for tile_slices in iter_tiles(array.shape, tile):
+        active = np.asarray(array[tile_slices]) > threshold
+        if not active.any():
+            continue
+        for axis in range(3):
+            other = tuple(a for a in range(3) if a != axis)
+            indices = np.flatnonzero(active.any(axis=other)) + tile_slices[axis].start
+            lo[axis] = min(lo[axis], indices[0])
+            hi[axis] = max(hi[axis], indices[-1] + 1)
+
+    if hi[0] < 0:
+        return None
+    return lo, hi
+
+
+def add_tiled(spool, array, tile=128, ijk=(0, 0, 0), norm=1.0, threshold=0.0, derived=()):
+    """
+    Adds a dense (possibly memory-mapped) array to a LeafSpool one tile at a time,
+    keeping memory bounded by the tile size (derived as in LeafSpool.add_array).
+    """
+    for tile_slices in iter_tiles(array.shape, tile, ijk):
+        offset = [s.start + o for s, o in zip(tile_slices, ijk)]
+        spool.add_array(array[tile_slices], ijk=offset, norm=norm, threshold=threshold,
+                        slab_leaves=tile // LEAF_DIM, derived=derived)
+
+
+def shading_fields(power=1.3, minimum=129, divide=2.6):
+    """
+    Fields baked by export_density for volume_material(baked=True), from the normalized
+    density: 'emission', the emission strength before the per-object multiply
+    (min(density^power, minimum)), and 'ramp', the position on the color ramp
+    (density / divide). The parameters must match those of the material.
+    """
+    return {'emission': lambda values: np.minimum(values**power, minimum),
+            'ramp': lambda values: values / divide}
+
+
+@instrument.timed('export_vdb')
+def export_density(density, filepath, tile=128, half=False, compress=True, name='density',
+                   crop=False, threshold=0.0, norm=None, voxel_size=1.0, translation=(0, 0, 0),
+                   fields=None):
+    """
+    Writes a dense (possibly memory-mapped) density as a fog volume normalized by its
+    maximum, in tiles: a first pass finds the maximum (and the active region), a second
+    one writes the sparse grid.
+    :param crop: Crop to the tight bounding box of the voxels above threshold. The crop
+        offset goes into the grid transform, so voxels keep their position in object space
+        and make_volume places the volume exactly as the uncropped one.
+    :param threshold: Normalized values at or below it are pruned (left inactive).
+    :param norm: Normalization (the maximum of density if None).
+    :param voxel_size, translation: Grid transform (before the crop offset).
+    :param fields: Extra grids computed in the same pass, {name: func}, func mapping
+        normalized density values to the field (e.g. shading_fields(), or a temperature).
+        They are active on the same voxels as the density.
+    """
+    with instrument.stage('normalize'):
+        max_val = tiled_nanmax(density, tile) if norm is None else norm
+    # An all-zero or all-NaN frame (e.g. the first frames of a sequence) has nothing to
+    # normalize by, and is written as an empty grid
+    empty = not max_val > 0
+
+    offset = np.zeros(3, dtype=np.int64)
+    if crop and not empty:
+        bbox = active_bbox(density, threshold * max_val, tile)
+        if bbox is not None:
+            offset, hi = bbox
+            density = density[offset[0]:hi[0], offset[1]:hi[1], offset[2]:hi[2]]
+
+    spool = LeafSpool(name, half=half, compress=compress)
+    derived = [(LeafSpool(field_name, half=half, compress=compress), func)
+               for field_name, func in (fields or {}).items()]
+    if not empty:
+        add_tiled(spool, density, tile=tile, norm=max_val, threshold=threshold, derived=derived)
+    spools = [spool] + [field_spool for field_spool, _ in derived]
+    write_vdb(filepath, spools, voxel_size=voxel_size,
+              translation=np.asarray(translation) + offset * voxel_size)
+    for s in spools:
+        s.close()
+
+    instrument.count('voxels_written', spool.voxel_count)
+    instrument.count('bytes_written', os.path.getsize(filepath))
+
+    return filepath
+
+
+def downsample(array, factor=2, slab=16):
+    """
+    Mass-conserving downsampling: each output voxel is the mean of a factor^3 block, so
+    with voxels factor times larger the integrated density is unchanged. The array is
+    zero-padded to a multiple of factor, and read slab by slab (works on memmaps).
+    :return: float32 array of shape ceil(shape / factor).
+    """
+    shape = [-(-n // factor) for n in array.shape]
+    out = np.zeros(shape, dtype=np.float32)
+
+    rows = slab * factor
+    for i0 in range(0, array.shape[0], rows):
+        block = np.zeros((rows, shape[1] * factor, shape[2] * factor))
+        values = array[i0:i0 + rows]
+        block[:len(values), :values.shape[1], :values.shape[2]] = values
+
+        block = block.reshape(slab, factor, shape[1], factor, shape[2], factor)
+        means = block.mean(axis=(1, 3, 5))
+        out[i0 // factor:i0 // factor + slab] = means[:len(out) - i0 // factor]
+
+    return out
+
+
+def lod_path(filepath, factor):
+    """
+    Path of the level of a LOD pyramid downsampled by factor ('density.vdb' -> 'density_lod4.vdb').
+    """
+    if factor == 1:
+        return filepath
+    root, ext = os.path.splitext(filepath)
+    return f'{root}_lod{factor}{ext}'
+
+
+def lod_factors(filepath):
+    """
+    Downsampling factors of the LOD levels found next to filepath (1 being filepath itself).
+    """
+    factors = [1]
+    while os.path.exists(lod_path(filepath, 2 * factors[-1])):
+        factors.append(2 * factors[-1])
+    return factors
+
+
+def export_lods(density, filepath, levels=3, tile=128, half=False, compress=True, name='density',
+                crop=False, threshold=0.0, norm=None, fields=None):
+    """
+    Writes the coarse levels of a LOD pyramid for the full-resolution volume at filepath:
+    levels downsampled by 2, 4, ... 2^levels (see downsample and lod_path). Every level is
+    normalized by the full-resolution maximum, and its voxel size (factor) makes it cover
+    the same index space, so make_volume can swap levels without other changes. No
+    half-block offset is needed, as Blender draws voxel ijk over the cell [ijk, ijk + 1].
+    Fields (see export_density) are computed from the downsampled density.
+    :return: List of written file paths.
+    """
+    if norm is None:
+        norm = tiled_nanmax(density, tile)
+
+    filepaths = []
+    for level in range(1, levels + 1):
+        factor = 2**level
+        # Each level is built from the previous one, which is already in memory
+        density = downsample(density, 2)
+        filepaths.append(export_density(density, lod_path(filepath, factor), tile=tile, half=half,
+                                        compress=compress, name=name, crop=crop, threshold=threshold,
+                                        norm=norm, voxel_size=factor, fields=fields))
+
+    return filepaths
+
+
+def convert_npy(npy_path, vdb_path, tile=128, half=False, compress=True, name='density',
+                crop=False, threshold=0.0, lod_levels=0, fields=None):
+    """
+    Out-of-core .npy to .vdb conversion: the .npy is memory-mapped and exported in tiles
+    (see export_density). Without cropping, the result is the same as save_vdb
+    (grid name, identity transform, fog volume class).
+    :param lod_levels: Number of coarse LOD levels also written (see export_lods).
+    :param fields: Extra grids written with the density (see export_density).
+    """
+    density = np.load(npy_path, mmap_mode='r')
+
+    export_density(density, vdb_path, tile=tile, half=half, compress=compress, name=name,
+                   crop=crop, threshold=threshold, fields=fields)
+    if lod_levels:
+        export_lods(density, vdb_path, lod_levels, tile=tile, half=half, compress=compress,
+                    name=name, crop=crop, threshold=threshold, fields=fields)
+
+    return vdb_path
+
+
+def save_vdb(density, savefold=None, filename='untitled', half=False, compress=True,
+             crop=False, threshold=0.0, lod_levels=0, fields=None):
+    """
+    Same as local_blutils.save_vdb (density normalized by its maximum, written as a
+    'density' fog volume with an identity transform), without pyopenvdb.
+    :param half: Store values as half floats.
+    :param compress: Zip-compress the node buffers.
+    :param crop, threshold: Active-region cropping and pruning (see export_density).
+    :param lod_levels: Number of coarse LOD levels also written (see export_lods).
+    :param fields: Extra grids written with the density (see export_density).
+    """
+    cwd = os.getcwd()
+
+    if savefold is None:
+        savefold = cwd + '/blender/vdb_files/'
+
+    if not os.path.exists(savefold):
+        os.makedirs(savefold)
+
+    filepath = savefold + filename + '.vdb'
+
+    export_density(density, filepath, half=half, compress=compress, crop=crop,
+                   threshold=threshold, fields=fields)
+    if lod_levels:
+        export_lods(density, filepath, lod_levels, half=half, compress=compress, crop=crop,
+                    threshold=threshold, fields=fields)
+
+    return filepath
+
+
+def read_vdb(filepath):
+    """
+    Reads the float grids of a .vdb file (uncompressed, zip, or blosc if the blosc
+    module is installed). Returns {name: grid}, each grid a dict with:
+        'metadata': {name: value}, 'transform': {'type', 'voxel_size', 'translation'},
+        'background', 'origins' (L, 3) and 'values' (L, 512) of the leaves,
+        'masks' (L, 512) active voxels of the leaves, and 'tiles': [(origin, size, value)]
+        for active tiles.
+    """
+    grids = {}
+
+    with open(filepath, 'rb') as f:
+        magic, version = struct.unpack('<qI', f.read(12))
+        if magic != MAGIC:
+            raise ValueError(f'{filepath} is not a VDB file.')
+        state = {'version': version, 'compression': COMPRESS_ZIP}
+        if version >= 211:
+            f.read(8)  # Library version
+        has_offsets = f.read(1) != b'\x00' if version >= 212 else False
+        if version < 222:
+            state['compression'] = COMPRESS_ZIP if f.read(1) != b'\x00' else COMPRESS_NONE
+        if version >= 218:
+            f.read(36)  # UUID
+        _read_metadata(f)
+
+        grid_count, = struct.unpack('<i', f.read(4))
+        for _ in range(grid_count):
+            name = _read_string(f).split('\x1e')[0]
+            grid_type = _read_string(f)
+            if version >= 216 and _read_string(f):
+                raise ValueError('Instanced grids are not supported.')
+            if has_offsets:
+                grid_pos, block_pos, end_pos = struct.unpack('<qqq', f.read(24))
+
+            state['half'] = grid_type.endswith(HALF_SUFFIX)
+            if grid_type.replace(HALF_SUFFIX, '') != GRID_TYPE:
+                raise ValueError(f'Unsupported grid type {grid_type}.')
+
+            grids[name] = _read_grid(f, state)
+            if has_offsets:
+                f.seek(end_pos)
+
+    return grids
+
+
+def grid_to_dense(grid):
+    """
+    Dense array over the bounding box of a grid read by read_vdb.
+    Returns the array and the index of its [0, 0, 0] voxel.
+    """
+    origins = grid['origins']
+    lo = [origins.min(axis=0)] if len(origins) else []
+    hi = [origins.max(axis=0) + LEAF_DIM] if len(origins) else []
+    for origin, size, value in grid['tiles']:
+        lo.append(np.asarray(origin))
+        hi.append(np.asarray(origin) + size)
+    if not lo:
+        return np.zeros((0, 0, 0), dtype=np.float32), np.zeros(3, dtype=np.int64)
+    lo, hi = np.min(lo, axis=0), np.max(hi, axis=0)
+
+    dense = np.full(hi - lo, grid['background'], dtype=np.float32)
+    for origin, size, value in grid['tiles']:
+        i, j, k = np.asarray(origin) - lo
+        dense[i:i + size, j:j + size, k:k + size] = value
+    for origin, values in zip(origins - lo, grid['values']):
+        i, j, k = origin
+        dense[i:i + LEAF_DIM, j:j + LEAF_DIM, k:k + LEAF_DIM] = values.reshape(LEAF_DIM, LEAF_DIM, LEAF_DIM)
+
+    return dense, lo
+
+
+def _read_string(f):
+    size, = struct.unpack('<I', f.read(4))
+    return f.read(size).decode(errors='replace')
+
+
+def _read_metadata(f):
+    metadata = {}
+    count, = struct.unpack('<i', f.read(4))
+    for _ in range(count):
+        name = _read_string(f)
+        type_name = _read_string(f)
+        size, = struct.unpack('<I', f.read(4))
+        data = f.read(size)
+        if type_name == 'string':
+            metadata[name] = data.decode(errors='replace')
+        elif type_name == 'bool':
+            metadata[name] = data != b'\x00'
+        elif type_name in ['vec3i', 'vec3d', 'int64', 'int32', 'float', 'double']:
+            fmt = {'vec3i': '<3i', 'vec3d': '<3d', 'int64': '<q', 'int32': '<i', 'float': '<f', 'double': '<d'}
+            value = struct.unpack(fmt[type_name], data)
+            metadata[name] = list(value) if len(value) > 1 else value[0]
+    return metadata
+
+
+def _read_transform(f):
+    map_type = _read_string(f)
+    translation = np.zeros(3)
+    if map_type == 'TranslationMap':
+        translation = np.frombuffer(f.read(24), '<f8')
+        scale = np.ones(3)
+    elif map_type in ['ScaleMap', 'UniformScaleMap', 'ScaleTranslateMap', 'UniformScaleTranslateMap']:
+        if 'Translate' in map_type:
+            translation = np.frombuffer(f.read(24), '<f8')
+        scale = np.frombuffer(f.read(120), '<f8')[:3]
+    elif map_type == 'AffineMap':
+        matrix = np.frombuffer(f.read(128), '<f8').reshape(4, 4)
+        scale, translation = np.diag(matrix)[:3], matrix[3, :3]
+    else:
+        raise ValueError(f'Unsupported transform {map_type}.')
+    return {'type': map_type, 'voxel_size': np.array(scale), 'translation': np.array(translation)}
+
+
+def _read_mask(f, log2):
+    data = np.frombuffer(f.read(1 << (3 * log2 - 3)), np.uint8)
+    return np.unpackbits(data, bitorder='little').astype(bool)
+
+
+def _read_data(f, count, state):
+    dtype = '<f2' if state['half'] else '<f4'
+    if state['half'] and count < 1:
+        return np.zeros(0, dtype=np.float32)
+
+    compression = state['compression']
+    if compression & (COMPRESS_BLOSC | COMPRESS_ZIP):
+        size, = struct.unpack('<q', f.read(8))
+        if size <= 0:
+            data = f.read(-size)
+        elif compression & COMPRESS_BLOSC:
+            import blosc
+            data = blosc.decompress(f.read(size))
+        else:
+            data = zlib.decompress(f.read(size))
+    else:
+        data = f.read(count * np.dtype(dtype).itemsize)
+    return np.frombuffer(data, dtype).astype(np.float32)
+
+
+def _read_values(f, count, value_mask, state):
+    """
+    Node values as written by io::writeCompressedValues.
+    """
+    metadata = NO_MASK_AND_ALL_VALS
+    if state['version'] >= 222:
+        metadata = f.read(1)[0]
+
+    background = state['background']
+    inactive = [-background if metadata == NO_MASK_AND_MINUS_BG else background, background]
+    if metadata == MASK_AND_NO_INACTIVE_VALS:
+        inactive[1] = -background
+    if metadata in [NO_MASK_AND_ONE_INACTIVE_VAL, MASK_AND_ONE_INACTIVE_VAL, MASK_AND_TWO_INACTIVE_VALS]:
+        inactive[0], = struct.unpack('<f', f.read(4))
+        if metadata == MASK_AND_TWO_INACTIVE_VALS:
+            inactive[1], = struct.unpack('<f', f.read(4))
+
+    selection = np.zeros(count, dtype=bool)
+    if metadata in [MASK_AND_NO_INACTIVE_VALS, MASK_AND_ONE_INACTIVE_VAL, MASK_AND_TWO_INACTIVE_VALS]:
+        selection = _read_mask(f, int(np.log2(count)) // 3)
+
+    if state['compression'] & COMPRESS_ACTIVE_MASK and metadata != NO_MASK_AND_ALL_VALS:
+        active = _read_data(f, int(value_mask.sum()), state)
+        values = np.where(selection, np.float32(inactive[1]), np.float32(inactive[0]))
+        values[value_mask] = active
+        return values
+    return _read_data(f, count, state)
+
+
+def _read_grid(f, state):
+    if state['version'] >= 222:
+        state['compression'], = struct.unpack('<I', f.read(4))
+    metadata = _read_metadata(f)
+    transform = _read_transform(f)
+
+    # Topology
+    f.read(4)  # Buffer count
+    state['background'], = struct.unpack('<f', f.read(4))
+    n_tiles, n_children = struct.unpack('<II', f.read(8))
+
+    tiles = []
+    for _ in range(n_tiles):
+        origin = struct.unpack('<3i', f.read(12))
+        value, active = struct.unpack('<f?', f.read(5))
+        if active:
+            tiles.append((origin, UPPER_DIM, value))
+
+    leaves = []
+    for _ in range(n_children):
+        upper_origin = np.array(struct.unpack('<3i', f.read(12)))
+        for lower_origin in _read_internal(f, upper_origin, UPPER_LOG2, LOWER_DIM, tiles, state):
+            for leaf_origin in _read_internal(f, lower_origin, LOWER_LOG2, LEAF_DIM, tiles, state):
+                leaves.append(leaf_origin)
+                f.read(LEAF_SIZE // 8)  # Leaf value mask, repeated with the buffers
+
+    # Buffers
+    masks = np.zeros((len(leaves), LEAF_SIZE), dtype=bool)
+    values = np.zeros((len(leaves), LEAF_SIZE), dtype=np.float32)
+    for n in range(len(leaves)):
+        masks[n] = _read_mask(f, LEAF_LOG2)
+        values[n] = _read_values(f, LEAF_SIZE, masks[n], state)
+
+    return {'metadata': metadata, 'transform': transform, 'background': state['background'],
+            'origins': np.array(leaves, dtype=np.int64).reshape(-1, 3), 'values': values,
+            'masks': masks, 'tiles': tiles}
+
+
+def _read_internal(f, origin, log2, child_dim, tiles, state):
+    """
+    Reads an internal node's masks and values, collects its active tiles, and returns
+    the origins of its children.
+    """
+    child_mask = _read_mask(f, log2)
+    value_mask = _read_mask(f, log2)
+    values = _read_values(f, 1 << (3 * log2), value_mask, state)
+
+    dim = 1 << log2
+    local = np.stack(np.unravel_index(np.arange(dim**3), (dim, dim, dim)), axis=1)
+    for n in np.flatnonzero(value_mask & ~child_mask):
+        tiles.append((tuple(origin + local[n] * child_dim), child_dim, values[n]))
+    return [origin + local[n] * child_dim for n in np.flatnonzero(child_mask)]
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if len(args) != 2:
+        print(__doc__)
+        sys.exit(1)
+
+    lods = [int(arg.split('=')[1]) for arg in sys.argv if arg.startswith('--lods=')]
+    convert_npy(args[0], args[1], half='--half' in sys.argv, compress='--no-compress' not in sys.argv,
+                crop='--crop' in sys.argv, lod_levels=lods[0] if lods else 0,
+                fields=shading_fields() if '--fields' in sys.argv else None)
@@ -0,0 +1,57 @@
+"""
+Compares utils.bin_points against np.histogramdd on uniform grids.
+
+Run from the code/ folder:
+    python benchmark_binning.py [N]
+"""
+import sys
+import time
+
+import numpy as np
+
+import utils as ut
+
+
+def best_time(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(N=1e7):
+    N = int(N)
+    rng = np.random.default_rng(0)
+    points = rng.normal(0, 3, (N, 3))
+    ranges = [10, 10, 10]
+
+    print(f'N = {N:.0e}')
+    print(f'{"resolution":>10} {"histogramdd [s]":>16} {"bin_points [s]":>15} {"float32 [s]":>12} {"speedup":>8}')
+
+    for resolution in [100, 256, 512]:
+        edges = ut.grid_edges(ranges, resolution)
+
+        t_hist = best_time(lambda: np.histogramdd(points, bins=edges))
+
+        out = np.zeros((resolution,) * 3)
+        def run_bin():
+            out[...] = 0
+            ut.bin_points(points, edges, out=out)
+        t_bin = best_time(run_bin)
+
+        out32 = np.zeros((resolution,) * 3, dtype=np.float32)
+        def run_bin32():
+            out32[...] = 0
+            ut.bin_points(points, edges, out=out32)
+        t_bin32 = best_time(run_bin32)
+
+        assert np.array_equal(np.histogramdd(points, bins=edges)[0], out)
+        del out, out32
+
+        print(f'{resolution:>10} {t_hist:>16.3f} {t_bin:>15.3f} {t_bin32:>12.3f} {t_hist / t_bin:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main(*[float(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,148 @@
+"""
+Benchmark of the density pipeline (sample_points, compute_density, save_density and the
+.vdb export of blender/vdb_io.py), without Blender. Sweeps N, resolution, precision and
+compression, and records wall time per stage, peak RSS and output sizes as JSON. Each case
+runs in its own process, so peak RSS is per case.
+
+Run from the code/ folder:
+    python benchmark_pipeline.py [--full] [--repeat=3] [--save=results.json] [--baseline=baseline.json] [--tolerance=0.2]
+
+--full sweeps N = 1e4-1e8 and resolutions 64-512 (the default is a quick sweep).
+Stage times are the best of --repeat runs.
+With --baseline, cases slower than the baseline by more than the tolerance (or with larger
+outputs) are reported, and the exit code is 1.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import itertools
+import subprocess
+
+import numpy as np
+
+import instrument
+
+QUICK = {'N': [1e4, 1e6], 'resolution': [64, 128], 'precision': ['float32', 'float64'],
+         'compressed': [False, True]}
+FULL = {'N': [1e4, 1e6, 1e8], 'resolution': [64, 128, 256, 512], 'precision': ['float16', 'float32', 'float64'],
+        'compressed': [False, True]}
+
+# Differences below this many seconds are not counted as regressions (timer noise)
+MIN_SECONDS = 0.1
+
+
+def case_name(case):
+    return f'N={case["N"]:.0e} res={case["resolution"]} {case["precision"]} compressed={case["compressed"]}'
+
+
+def run_case(N, resolution, precision, compressed, repeat=3):
+    """
+    Runs the pipeline repeat times, in this process.
+    :return: Best stage times in seconds, peak RSS in MB and output sizes in bytes.
+    """
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'blender'))
+    import utils as ut
+    import vdb_io
+
+    times = {}
+    r_max = 10
+    sample = ut.Sample(lambda r: np.where(r < r_max, 1, 0), r_max=r_max)
+
+    def timed(stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        value = func(*args, **kwargs)
+        times[stage] = min(times.get(stage, np.inf), time.perf_counter() - start)
+        return value
+
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as folder:
+            timed('sample_points', sample.sample_points, N, seed=0)
+            timed('compute_density', sample.compute_density, ranges=[r_max] * 3, resolution=resolution)
+
+            filename = os.path.join(folder, 'density')
+            timed('save_density', sample.save_density, filename, float_precision=precision,
+                  compressed=compressed)
+            npy_path = filename + ('.npz' if compressed else '.npy')
+
+            vdb_path = timed('save_vdb', vdb_io.save_vdb, sample.density, savefold=folder + '/',
+                             filename='density')
+
+            sizes = {'density': os.path.getsize(npy_path), 'vdb': os.path.getsize(vdb_path)}
+
+    return {'times': times, 'total': sum(times.values()), 'peak_rss_mb': instrument.peak_rss_mb(),
+            'sizes': sizes}
+
+
+def run_sweep(sweep, repeat=3):
+    results = []
+    keys = list(sweep)
+    for values in itertools.product(*sweep.values()):
+        case = dict(zip(keys, values))
+        output = subprocess.run([sys.executable, os.path.abspath(__file__),
+                                 '--case=' + json.dumps(dict(case, repeat=repeat))],
+                                capture_output=True, text=True, check=True)
+        result = dict(case, **json.loads(output.stdout.splitlines()[-1]))
+        results.append(result)
+        print(f'{case_name(case):<45} {result["total"]:>8.3f} s {result["peak_rss_mb"]:>9.1f} MB '
+              f'{result["sizes"]["density"] / 1e6:>9.2f} MB {result["sizes"]["vdb"] / 1e6:>8.2f} MB')
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Regressions of results against baseline (both lists of cases from run_sweep).
+    :return: List of messages, empty if there is no regression.
+    """
+    reference = {case_name(case): case for case in baseline}
+    regressions = []
+    for result in results:
+        name = case_name(result)
+        if name not in reference:
+            continue
+        base = reference[name]
+        for stage, seconds in result['times'].items():
+            base_seconds = base['times'].get(stage)
+            if base_seconds is None:
+                continue
+            if seconds > base_seconds * (1 + tolerance) and seconds - base_seconds > MIN_SECONDS:
+                regressions.append(f'{name}: {stage} {base_seconds:.3f} s -> {seconds:.3f} s')
+        if result['peak_rss_mb'] > base['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f'{name}: peak RSS {base["peak_rss_mb"]:.1f} MB -> {result["peak_rss_mb"]:.1f} MB')
+        for output, size in result['sizes'].items():
+            if size > base['sizes'][output]:
+                regressions.append(f'{name}: {output} size {base["sizes"][output]} -> {size} bytes')
+    return regressions
+
+
+def main():
+    options = dict(arg[2:].split('=', 1) if '=' in arg else (arg[2:], True)
+                   for arg in sys.argv[1:] if arg.startswith('--'))
+
+    if 'case' in options:
+        # Child process of run_sweep
+        case = json.loads(options['case'])
+        print(json.dumps(run_case(**case)))
+        return
+
+    print(f'{"case":<45} {"time":>10} {"peak RSS":>12} {"density":>12} {"vdb":>11}')
+    results = run_sweep(FULL if 'full' in options else QUICK, int(options.get('repeat', 3)))
+
+    if 'save' in options:
+        with open(options['save'], 'w') as f:
+            json.dump(results, f, indent=1)
+
+    if 'baseline' in options:
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, float(options.get('tolerance', 0.2)))
+        for message in regressions:
+            print('Regression:', message)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against', options['baseline'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+On-disk cache of density cubes, keyed by a hash of everything that determines them
+(tabulated radial profile, a/b/c, N, seed, ranges, resolution, precision...), so
+re-running a notebook or a parameter sweep only computes the cubes that changed.
+Files derived from a cube (e.g. its .vdb) are cached alongside it. The cache is bounded
+in size, evicting the least recently used cubes.
+
+    cache = DensityCache('../data/cache')
+    density, edges = cache.density(sample, N=1e7, ranges=[10, 10, 10], resolution=256, seed=0)
+    vdb_path = cache.derived(cache.last_key, 'density.vdb',
+                             lambda path: vdb_io.convert_npy(cache.path(cache.last_key), path))
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+
+import numpy as np
+
+from utils import CHUNK_SIZE
+
+
+class DensityCache:
+    def __init__(self, folder='../data/cache', max_bytes=8 * 1024**3):
+        """
+        :param folder: Folder of the cache, created if needed.
+        :param max_bytes: Size above which the least recently used entries are evicted.
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.last_key = None
+
+        os.makedirs(folder, exist_ok=True)
+        self.index_path = os.path.join(folder, 'index.json')
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+        # Forget entries whose folder was removed by hand
+        self.index = {key: entry for key, entry in self.index.items()
+                      if os.path.isdir(os.path.join(folder, key))}
+
+    def key(self, sample, N, ranges, resolution, seed, float_precision='float32',
+            method='rejection', scheme='ngp', chunk_size=CHUNK_SIZE):
+        """
+        Hash of the parameters determining a density cube. The radial profile enters
+        through its values tabulated over sample.r_vals.
+        """
+        h = hashlib.sha256()
+        h.update(np.ascontiguousarray(sample.radial_profile(sample.r_vals), dtype=float).tobytes())
+        h.update(np.ascontiguousarray(sample.r_vals, dtype=float).tobytes())
+        params = [sample.a, sample.b, sample.c, int(N), list(ranges), resolution, seed,
+                  float_precision, method, scheme, chunk_size]
+        h.update(json.dumps(params, default=float).encode())
+
+        return h.hexdigest()[:32]
+
+    def path(self, key, filename='density.npy'):
+        """
+        Path of a file of the entry key.
+        """
+        return os.path.join(self.folder, key, filename)
+
+    def density(self, sample, N, ranges=[1, 1, 1], resolution=10, seed=0, float_precision='float32',
+                method='rejection', scheme='ngp', chunk_size=CHUNK_SIZE, workers=None):
+        """
+        Density cube of sample for the given parameters, read from the cache if it was
+        computed before, otherwise computed with stream_density (parallel_density if
+        workers is given) and saved with float_precision. Either way, the density is
+        memory-mapped read-only from the cache and set on sample, as compute_density does.
+        A seed is required, since unseeded runs cannot be reproduced.
+        :return: The density and the edges.
+        """
+        if seed is None:
+            raise ValueError('A seed is required to cache a density.')
+
+        key = self.key(sample, N, ranges, resolution, seed, float_precision, method, scheme, chunk_size)
+        self.last_key = key
+
+        params = {'N': int(N), 'ranges': list(ranges), 'resolution': resolution, 'seed': seed,
+                  'float_precision': float_precision, 'method': method, 'scheme': scheme}
+        folder = os.path.join(self.folder, key)
+
+        # Entry folders only appear complete (see below), so one that exists is a hit, even
+        # without an index entry (computed by another process sharing the cache, or index.json lost)
+        if os.path.isdir(folder):
+            self.hits += 1
+            self.index.setdefault(key, {'params': params, 'compute_time': None})
+        else:
+            self.misses += 1
+
+            # Written to a temporary folder first, so interrupted runs leave no entry
+            tmp_folder = os.path.join(self.folder, f'{key}.{os.getpid()}.tmp')
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+            os.makedirs(tmp_folder)
+
+            start = time.perf_counter()
+            if workers is None:
+                sample.stream_density(N, ranges=ranges, resolution=resolution, seed=seed,
+                                      chunk_size=chunk_size, method=method, scheme=scheme)
+            else:
+                sample.parallel_density(N, ranges=ranges, resolution=resolution, seed=seed, workers=workers,
+                                        chunk_size=chunk_size, method=method, scheme=scheme)
+            sample.save_density(os.path.join(tmp_folder, 'density'), float_precision=float_precision)
+            np.savez(os.path.join(tmp_folder, 'edges.npz'), *sample.edges)
+
+            try:
+                os.replace(tmp_folder, folder)
+            except OSError:
+                # Another process finished the same cube first: its copy is kept
+                if not os.path.isdir(folder):
+                    raise
+                shutil.rmtree(tmp_folder, ignore_errors=True)
+            self.index[key] = {'params': params, 'compute_time': time.perf_counter() - start}
+
+        self._touch(key)
+
+        with np.load(self.path(key, 'edges.npz')) as f:
+            edges = [f[f'arr_{i}'] for i in range(3)]
+        density = np.load(self.path(key), mmap_mode='r')
+
+        sample.density = density
+        sample.edges = edges
+        sample.n_points = int(N)
+
+        self._evict(keep=key)
+
+        return density, edges
+
+    def derived(self, key, filename, make):
+        """
+        Path of a file derived from the cube of entry key (e.g. 'density.vdb'), made on
+        the first call by make(path) and cached with the entry afterwards.
+        """
+        if key not in self.index:
+            raise ValueError(f'No cache entry {key}.')
+
+        path = self.path(key, filename)
+        if os.path.exists(path):
+            self.hits += 1
+        else:
+            self.misses += 1
+            make(path + '.tmp')
+            os.replace(path + '.tmp', path)
+
+        self._touch(key)
+        self._evict(keep=key)
+
+        return path
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        # Entries added by other processes sharing the cache too
+        self._save_index()
+        for key in list(self.index):
+            self._remove(key)
+        self._save_index()
+
+    def stats(self):
+        """
+        Hits, misses and evictions of this session, and the number of entries and bytes on disk.
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.index),
+                'bytes': sum(entry['bytes'] for entry in self.index.values()),
+                'max_bytes': self.max_bytes}
+
+    def _touch(self, key):
+        entry = self.index[key]
+        entry['last_used'] = time.time()
+        entry['bytes'] = sum(os.path.getsize(os.path.join(self.folder, key, name))
+                             for name in os.listdir(os.path.join(self.folder, key)))
+        self._save_index()
+
+    def _evict(self, keep=None):
+        """
+        Removes least recently used entries (never keep) until the cache fits in max_bytes.
+        """
+        total = sum(entry['bytes'] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self.index[key]['bytes']
+            self._remove(key)
+            self.evictions += 1
+        self._save_index()
+
+    def _remove(self, key):
+        shutil.rmtree(os.path.join(self.folder, key), ignore_errors=True)
+        del self.index[key]
+
+    def _save_index(self):
+        # Merged with index.json, which other processes sharing the cache may have saved
+        # since (the latest use of an entry wins, and entries whose folder is gone are dropped)
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                saved = json.load(f)
+            for key, entry in saved.items():
+                if key not in self.index or entry.get('last_used', 0) > self.index[key].get('last_used', 0):
+                    self.index[key] = entry
+        self.index = {key: entry for key, entry in self.index.items()
+                      if os.path.isdir(os.path.join(self.folder, key))}
+
+        tmp_path = f'{self.index_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp_path, self.index_path)
@@ -0,0 +1,293 @@
+"""
+Storage formats of density cubes beyond plain .npy: quantized '.npq' files (8 or 12 bits
+per voxel, with a bounded error, readable by region), and '.nps' sequences of frames
+(keyframes plus the blocks changed since the previous frame).
+"""
+import os
+import json
+import zipfile
+
+import numpy as np
+
+import instrument
+
+
+def write_npy(fp, array, dtype, slab_bytes=1 << 26):
+    """
+    Writes array in .npy format to an open file, converting it to dtype one slab
+    (along the first axis) of about slab_bytes at a time.
+    """
+    dtype = np.dtype(dtype)
+    header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': array.shape}
+    np.lib.format.write_array_header_1_0(fp, header)
+
+    rows = max(1, slab_bytes // max(1, array[:1].size * dtype.itemsize))
+    for start in range(0, len(array), rows):
+        fp.write(np.ascontiguousarray(array[start:start + rows], dtype=dtype).data)
+
+
+def _compand(x, companding, gamma, knee):
+    if companding is None:
+        return x
+    if companding == 'log':
+        return np.log1p(x / knee)
+    if companding == 'power':
+        return x**gamma
+    raise ValueError('Invalid companding specified.')
+
+
+def _expand(y, companding, gamma, knee):
+    if companding is None:
+        return y
+    if companding == 'log':
+        return knee * np.expm1(y)
+    return np.maximum(y, 0)**(1 / gamma)
+
+
+def _pack12(q):
+    """
+    Packs 12-bit values two per three bytes.
+    """
+    q = np.append(q, np.zeros(len(q) % 2, dtype=q.dtype)).astype(np.uint16)
+    a, b = q[0::2], q[1::2]
+    return np.stack([a & 0xff, (a >> 8) | ((b & 0xf) << 4), b >> 4], axis=1).astype(np.uint8).ravel()
+
+
+def _unpack12(data, count):
+    data = data.reshape(-1, 3).astype(np.uint16)
+    a = data[:, 0] | ((data[:, 1] & 0xf) << 8)
+    b = (data[:, 1] >> 4) | (data[:, 2] << 4)
+    return np.stack([a, b], axis=1).ravel()[:count]
+
+
+def save_quantized(filename, array, bits=None, companding=None, gamma=1.3, knee=1e-3,
+                   max_error=None, chunk=64):
+    """
+    Saves a density as '{filename}.npq': values quantized to 8 or 12 bits with a stored
+    scale and offset, in independently compressed chunks of chunk^3 voxels (a zip archive,
+    so regions can be read without decoding the rest, see load_quantized).
+    :param bits: 8 or 12. If None, the smallest meeting max_error.
+    :param companding: None (linear steps), 'log' (steps uniform in log(1 + x / (knee * max)),
+        fine at low densities) or 'power' (uniform in x**gamma, as the POWER node of
+        volume_material shows the density, so steps are even in emission).
+    :param max_error: Maximum absolute error allowed. The error bound of the chosen
+        quantization is computed exactly (it is stored in the header), and a ValueError is
+        raised if it exceeds max_error.
+    :return: The header, with the error bound in 'max_error'.
+    """
+    if bits not in [None, 8, 12]:
+        raise ValueError('Invalid number of bits specified.')
+
+    # Range of the values, slab by slab (works on memmaps)
+    lo, hi = np.inf, -np.inf
+    for start in range(0, len(array), chunk):
+        slab = np.asarray(array[start:start + chunk], dtype=float)
+        lo, hi = min(lo, slab.min()), max(hi, slab.max())
+    if lo < 0 and companding is not None:
+        raise ValueError('Companding needs non-negative densities.')
+    # The knee is relative to the maximum (kept as is for an all-zero density)
+    knee = knee * hi if hi > 0 else knee
+
+    y_lo, y_hi = _compand(np.array([lo, hi]), companding, gamma, knee)
+
+    for n_bits in ([8, 12] if bits is None else [bits]):
+        levels = 2**n_bits - 1
+        scale = (y_hi - y_lo) / levels if y_hi > y_lo else 1.0
+        # Worst error of each level: the farthest value of its cell, decoded back
+        y = y_lo + scale * np.arange(levels + 1)
+        x = _expand(y, companding, gamma, knee)
+        x_down = _expand(np.maximum(y - scale / 2, y_lo), companding, gamma, knee)
+        x_up = _expand(np.minimum(y + scale / 2, y_hi), companding, gamma, knee)
+        error = max(np.max(x - x_down), np.max(x_up - x)) if y_hi > y_lo else 0.0
+        if max_error is None or error <= max_error:
+            break
+    else:
+        raise ValueError(f'{n_bits} bits give a maximum error of {error:.3g}, above {max_error:.3g}.')
+
+    header = {'shape': list(array.shape), 'chunk': chunk, 'bits': n_bits, 'scale': scale,
+              'offset': float(y_lo), 'companding': companding, 'gamma': gamma, 'knee': float(knee),
+              'max_error': float(error)}
+
+    with zipfile.ZipFile(f'{filename}.npq', 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('header.json', json.dumps(header))
+        for i in range(0, array.shape[0], chunk):
+            slab = np.asarray(array[i:i + chunk], dtype=float)
+            q = np.rint((_compand(slab, companding, gamma, knee) - y_lo) / scale)
+            q = np.clip(q, 0, 2**n_bits - 1).astype(np.uint16)
+            for j in range(0, array.shape[1], chunk):
+                for k in range(0, array.shape[2], chunk):
+                    block = q[:, j:j + chunk, k:k + chunk].ravel()
+                    data = block.astype(np.uint8) if n_bits == 8 else _pack12(block)
+                    zf.writestr(f'{i // chunk}_{j // chunk}_{k // chunk}', data.tobytes())
+
+    instrument.count('bytes_written', os.path.getsize(f'{filename}.npq'))
+
+    return header
+
+
+def load_quantized(filename, region=None):
+    """
+    Reads a density saved by save_quantized.
+    :param region: Optional tuple of three slices (with steps of one). Only the chunks
+        overlapping it are decoded.
+    :return: float32 array of the region (of the whole density if None).
+    """
+    with zipfile.ZipFile(f'{filename}.npq') as zf:
+        header = json.loads(zf.read('header.json'))
+        shape, chunk = header['shape'], header['chunk']
+
+        if region is None:
+            region = (slice(None),) * 3
+        bounds = [s.indices(n)[:2] for s, n in zip(region, shape)]
+        out = np.zeros([stop - start for start, stop in bounds], dtype=np.float32)
+
+        chunk_ranges = [range(start // chunk, -(-stop // chunk)) for start, stop in bounds]
+        for ci in chunk_ranges[0]:
+            for cj in chunk_ranges[1]:
+                for ck in chunk_ranges[2]:
+                    lo = [c * chunk for c in (ci, cj, ck)]
+                    size = [min(chunk, n - l) for n, l in zip(shape, lo)]
+                    data = np.frombuffer(zf.read(f'{ci}_{cj}_{ck}'), dtype=np.uint8)
+                    q = data if header['bits'] == 8 else _unpack12(data, np.prod(size))
+                    y = header['offset'] + header['scale'] * q.reshape(size).astype(float)
+                    block = _expand(y, header['companding'], header['gamma'], header['knee'])
+
+                    # Overlap of the chunk with the region
+                    src, dst = [], []
+                    for l, n, (start, stop) in zip(lo, size, bounds):
+                        first, last = max(l, start), min(l + n, stop)
+                        src.append(slice(first - l, last - l))
+                        dst.append(slice(first - start, last - start))
+                    out[tuple(dst)] = block[tuple(src)]
+
+    return out
+
+
+def _to_blocks(array, block):
+    """
+    Array split into block^3 blocks (zero-padded at the upper edges), shape (n_blocks, block^3).
+    """
+    padded_shape = [-(-n // block) * block for n in array.shape]
+    padded = np.zeros(padded_shape, dtype=array.dtype)
+    padded[:array.shape[0], :array.shape[1], :array.shape[2]] = array
+    nx, ny, nz = [n // block for n in padded_shape]
+    blocks = padded.reshape(nx, block, ny, block, nz, block).transpose(0, 2, 4, 1, 3, 5)
+    return blocks.reshape(-1, block**3)
+
+
+def _set_blocks(array, indices, blocks, block):
+    """
+    Writes blocks (from _to_blocks) back into array.
+    """
+    n_blocks = [-(-n // block) for n in array.shape]
+    for index, values in zip(indices, blocks):
+        i, j, k = [n * block for n in np.unravel_index(index, n_blocks)]
+        target = array[i:i + block, j:j + block, k:k + block]
+        target[...] = values.reshape(block, block, block)[:target.shape[0], :target.shape[1], :target.shape[2]]
+
+
+class SequenceWriter:
+    """
+    Writes a sequence of density frames to '{filename}.nps' (a zip archive): every
+    keyframe_interval-th frame is stored whole, the others as the block^3 blocks that
+    changed since the previous frame. Lossless; only the previous frame is kept in memory.
+    Frames are read back with SequenceReader.
+
+        with SequenceWriter('density_sequence') as writer:
+            for frame in frames:
+                writer.append(frame)
+    """
+
+    def __init__(self, filename, keyframe_interval=20, block=16):
+        self.filename = f'{filename}.nps'
+        self.keyframe_interval = keyframe_interval
+        self.block = block
+        self.n_frames = 0
+        self.previous = None
+        self.zf = zipfile.ZipFile(self.filename, 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def append(self, frame):
+        """
+        Adds a frame (e.g. Sample.density).
+        """
+        frame = np.asarray(frame)
+        if self.previous is None:
+            self.shape, self.dtype = frame.shape, frame.dtype
+        elif frame.shape != self.shape or frame.dtype != self.dtype:
+            raise ValueError('All frames must have the same shape and dtype.')
+
+        if self.n_frames % self.keyframe_interval == 0:
+            with self.zf.open(f'frame_{self.n_frames}', 'w', force_zip64=True) as f:
+                write_npy(f, frame, frame.dtype)
+        else:
+            blocks = _to_blocks(frame, self.block)
+            changed = np.flatnonzero(np.any(blocks != _to_blocks(self.previous, self.block), axis=1))
+            with self.zf.open(f'frame_{self.n_frames}', 'w', force_zip64=True) as f:
+                np.save(f, changed.astype(np.int64))
+                np.save(f, blocks[changed])
+
+        self.previous = frame.copy()
+        self.n_frames += 1
+
+    def close(self):
+        header = {'n_frames': self.n_frames, 'keyframe_interval': self.keyframe_interval,
+                  'block': self.block}
+        self.zf.writestr('header.json', json.dumps(header))
+        self.zf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SequenceReader:
+    """
+    Reads a sequence written by SequenceWriter. frame(i) decodes any frame from the
+    nearest keyframe before it; iterating yields the frames in order, holding one frame
+    in memory.
+    """
+
+    def __init__(self, filename):
+        self.zf = zipfile.ZipFile(f'{filename}.nps')
+        header = json.loads(self.zf.read('header.json'))
+        self.n_frames = header['n_frames']
+        self.keyframe_interval = header['keyframe_interval']
+        self.block = header['block']
+
+    def __len__(self):
+        return self.n_frames
+
+    def _apply(self, i, current):
+        """
+        Frame i, from the frame before it (current, updated in place) unless i is a keyframe.
+        """
+        with self.zf.open(f'frame_{i}') as f:
+            if i % self.keyframe_interval == 0:
+                return np.load(f)
+            changed = np.load(f)
+            blocks = np.load(f)
+        _set_blocks(current, changed, blocks, self.block)
+        return current
+
+    def frame(self, i):
+        """
+        Decodes frame i.
+        """
+        if not 0 <= i < self.n_frames:
+            raise IndexError(f'Frame {i} out of range.')
+        current = None
+        for j in range(i - i % self.keyframe_interval, i + 1):
+            current = self._apply(j, current)
+        return current
+
+    def __iter__(self):
+        current = None
+        for i in range(self.n_frames):
+            current = self._apply(i, current)
+            # Copies, so frames kept by the caller are not changed by the next deltas
+            yield current.copy()
+
+    def close(self):
+        self.zf.close()
@@ -0,0 +1,185 @@
+"""
+Stage timers and counters for the volume pipeline (sampling, binning, saving, .vdb
+export, volume import, materials, scene reset). Instrumentation is off until a sink is
+added, and then costs a flag check per stage:
+
+    import instrument
+    instrument.add_sink(instrument.JsonLinesSink('stages.jsonl'))
+    ...
+    print(instrument.summarize('stages.jsonl'))
+
+Each finished stage sends a record to the sinks: {'stage', 'parent', 'start', 'seconds',
+'peak_rss_mb', 'counters', ...}, plus 'peak_alloc_mb' if allocations are traced
+(enable(allocations=True), with tracemalloc). With enable(profile_dir=...), top-level
+stages are also run under cProfile, and their stats written to profile_dir.
+"""
+import os
+import sys
+import json
+import time
+import cProfile
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+# Not available on Windows, where peak RSS is not recorded
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_sinks = []
+_stack = []
+_options = {'allocations': False, 'profile_dir': None}
+_profiles = 0
+
+
+def add_sink(sink):
+    """
+    Adds a sink, any callable taking a stage record. Instrumentation is on while there are sinks.
+    """
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+
+def enable(allocations=False, profile_dir=None):
+    """
+    Options of the records (instrumentation itself is turned on by add_sink).
+    :param allocations: Trace allocations with tracemalloc (slows down the run).
+    :param profile_dir: Folder where cProfile stats of top-level stages are written.
+    """
+    _options['allocations'] = allocations
+    _options['profile_dir'] = profile_dir
+    if allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+
+
+def active():
+    """
+    Whether stages are being recorded (to skip computing costly counters otherwise).
+    """
+    return bool(_sinks)
+
+
+def count(name, value=1):
+    """
+    Adds value to counter name of the innermost running stage (no-op if none).
+    """
+    if _stack:
+        counters = _stack[-1]['counters']
+        counters[name] = counters.get(name, 0) + value
+
+
+@contextmanager
+def stage(name, **info):
+    """
+    Records the block as stage name, with info added to its record.
+    """
+    if not _sinks:
+        yield
+        return
+
+    global _profiles
+    record = {'stage': name, 'parent': _stack[-1]['stage'] if _stack else None, 'pid': os.getpid(),
+              'start': time.time(), 'counters': {}, **info}
+
+    tracing = _options['allocations'] and tracemalloc.is_tracing()
+    if tracing:
+        # The parent keeps the peak reached so far, as each stage resets it
+        if _stack:
+            _stack[-1]['peak_alloc_mb'] = max(_stack[-1].get('peak_alloc_mb', 0),
+                                              tracemalloc.get_traced_memory()[1] / 1024**2)
+        tracemalloc.reset_peak()
+
+    profile = None
+    if _options['profile_dir'] is not None and not _stack:
+        profile = cProfile.Profile()
+        profile.enable()
+
+    _stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        _stack.pop()
+
+        if profile is not None:
+            profile.disable()
+            _profiles += 1
+            profile.dump_stats(os.path.join(_options['profile_dir'], f'{name}_{os.getpid()}_{_profiles}.prof'))
+
+        if tracing:
+            peak = max(record.get('peak_alloc_mb', 0), tracemalloc.get_traced_memory()[1] / 1024**2)
+            record['peak_alloc_mb'] = peak
+            if _stack:
+                _stack[-1]['peak_alloc_mb'] = max(_stack[-1].get('peak_alloc_mb', 0), peak)
+            tracemalloc.reset_peak()
+
+        if resource is not None:
+            record['peak_rss_mb'] = peak_rss_mb()
+
+        for sink in _sinks:
+            sink(record)
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process so far, in MB (None where not available).
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kB on Linux (bytes on macOS)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024**2 if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def timed(name):
+    """
+    Decorator recording every call of a function as stage name.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _sinks:
+                return func(*args, **kwargs)
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class JsonLinesSink:
+    """
+    Appends each record as a line of JSON to a file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, default=float) + '\n')
+
+
+def summarize(path):
+    """
+    Totals per stage of a JSON-lines file: {stage: {'calls', 'seconds', 'mean_seconds', 'counters'}}.
+    """
+    summary = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            entry = summary.setdefault(record['stage'], {'calls': 0, 'seconds': 0.0, 'counters': {}})
+            entry['calls'] += 1
+            entry['seconds'] += record['seconds']
+            for name, value in record['counters'].items():
+                entry['counters'][name] = entry['counters'].get(name, 0) + value
+    for entry in summary.values():
+        entry['mean_seconds'] = entry['seconds'] / entry['calls']
+    return summary
@@ -1,6 +1,241 @@
+import os
+import zipfile
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import matplotlib.pyplot as plt
 
+import instrument
+import density_storage
+
+# Number of points generated at once by the chunked (seeded) sampling paths.
+CHUNK_SIZE = 1_000_000
+
+# np.trapz was renamed np.trapezoid in NumPy 2.0 (and removed in NumPy 2.4)
+trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+
+def chunk_rng(seed, index):
+    """
+    Random generator for chunk `index`, spawned from the SeedSequence of `seed`.
+    Every chunk gets an independent stream, so chunks can be drawn in any order.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(index,)))
+
+
+# Instance of the worker processes of Sample.parallel_density.
+_worker_sample = None
+
+
+def _init_worker(sample):
+    global _worker_sample
+    _worker_sample = sample
+
+
+def _chunk_shares(i, N, seed, chunk_size, method, edges, scheme, noise):
+    """
+    Worker task: draws chunk i of a seeded run and reduces it to the occupied voxels of
+    each of its shares (see _point_shares). Returns [(flat, counts, squares)], squares
+    being the counts of the squared weights if noise (else None).
+    """
+    start = i * chunk_size
+    stop = min(start + chunk_size, N)
+    points = _worker_sample._draw_points(stop - start, method=method, rng=chunk_rng(seed, i))
+
+    size = int(np.prod([len(e) - 1 for e in edges]))
+    shares = []
+    for flat, weights in _point_shares(points, edges, scheme):
+        occupied, counts = _sparse_counts(flat, weights, size)
+        squares = None
+        if noise:
+            squares = counts if weights is None else _sparse_counts(flat, weights**2, size)[1]
+        shares.append((occupied, counts, squares))
+    return shares
+
+
+def grid_edges(ranges, resolution):
+    """
+    Voxel edges along x, y, z for a grid spanning [-ranges[i], ranges[i]].
+    :param resolution: Number of voxels per axis (int or three ints).
+    """
+    resolution = np.broadcast_to(resolution, 3)
+    return [np.linspace(-ranges[i], ranges[i], int(resolution[i]) + 1) for i in range(3)]
+
+
+def open_density(filename, edges, dtype='float64'):
+    """
+    Zeroed density grid for the given edges. If filename is given, the grid is an
+    on-disk '{filename}.npy' memmap, so it can be accumulated into and saved without
+    ever holding the full cube in memory.
+    """
+    shape = tuple(len(e) - 1 for e in edges)
+    if filename is None:
+        return np.zeros(shape, dtype=dtype)
+    return np.lib.format.open_memmap(f'{filename}.npy', mode='w+', dtype=dtype, shape=shape)
+
+
+def bin_points(points, edges, out=None, weights=None, dtype='float64'):
+    """
+    Bins points on the uniform, axis-aligned grid given by edges (see grid_edges).
+    Voxel indices are computed arithmetically, so the counts are the same as
+    np.histogramdd(points, bins=edges) (the last voxel includes its right edge)
+    without the per-axis searchsorted.
+    :param points: Array of shape (N, 3).
+    :param out: C-contiguous array of the grid shape to accumulate into. If None, a
+        zeroed array of the given dtype is created.
+    :param weights: Optional per-point weights.
+    """
+    shape = tuple(len(e) - 1 for e in edges)
+    if out is None:
+        out = np.zeros(shape, dtype=dtype)
+    elif out.shape != shape or not out.flags.c_contiguous:
+        raise ValueError('out must be a C-contiguous array of the grid shape.')
+
+    for flat, point_weights in _point_shares(points, edges, 'ngp', weights):
+        _accumulate(out, flat, point_weights)
+
+    return out
+
+
+def _axis_indices(x, e):
+    """
+    Voxel indices of coordinates x along an axis with uniform edges e, and whether
+    each coordinate is within the edges (indices of those outside are meaningless).
+    """
+    n = len(e) - 1
+    inside = (x >= e[0]) & (x <= e[-1])
+
+    idx = np.where(inside, (x - e[0]) * (n / (e[-1] - e[0])), 0).astype(np.intp)
+    np.clip(idx, 0, n - 1, out=idx)
+    # Correct rounding at the voxel edges so boundaries match histogramdd.
+    idx -= x < e[idx]
+    idx += (x >= e[idx + 1]) & (idx < n - 1)
+
+    return idx, inside
+
+
+def deposit_points(points, edges, scheme='ngp', out=None, weights=None, dtype='float64', variance=None):
+    """
+    Deposits points on the uniform grid given by edges with a mass-assignment scheme:
+    'ngp' (nearest grid point, same as bin_points), 'cic' (cloud in cell, shared over
+    2 voxels per axis) or 'tsc' (triangular shaped cloud, 3 voxels per axis).
+    Each point inside the grid deposits its full weight; shares that would fall outside
+    are folded back into the boundary voxels, so the total mass is conserved.
+    :param out: C-contiguous array of the grid shape to accumulate into (see bin_points).
+    :param weights: Optional per-point weights.
+    :param variance: Optional array of the grid shape accumulating the sum of squared
+        shares, an estimate of the shot-noise variance of each voxel.
+    """
+    if scheme not in ['ngp', 'cic', 'tsc']:
+        raise ValueError('Invalid deposition scheme specified.')
+
+    shape = tuple(len(e) - 1 for e in edges)
+    if out is None:
+        out = np.zeros(shape, dtype=dtype)
+    elif out.shape != shape or not out.flags.c_contiguous:
+        raise ValueError('out must be a C-contiguous array of the grid shape.')
+
+    for flat, w in _point_shares(points, edges, scheme, weights):
+        _accumulate(out, flat, w)
+        if variance is not None:
+            _accumulate(variance, flat, None if w is None else w**2)
+
+    return out
+
+
+def _point_shares(points, edges, scheme='ngp', weights=None):
+    """
+    Flat voxel indices and weights deposited by points with a mass-assignment scheme
+    (see deposit_points), as (flat, weights) pairs: one for 'ngp', one per neighbour
+    offset for 'cic'/'tsc'. Weights are None for unweighted 'ngp'.
+    """
+    shape = tuple(len(e) - 1 for e in edges)
+
+    if scheme == 'ngp':
+        flat = np.zeros(len(points), dtype=np.intp)
+        inside = np.ones(len(points), dtype=bool)
+        for axis, e in enumerate(edges):
+            idx, axis_inside = _axis_indices(points[:, axis], e)
+            inside &= axis_inside
+            flat *= len(e) - 1
+            flat += idx
+        yield flat[inside], None if weights is None else np.asarray(weights)[inside]
+        return
+
+    inside = np.ones(len(points), dtype=bool)
+    for axis, e in enumerate(edges):
+        x = points[:, axis]
+        inside &= (x >= e[0]) & (x <= e[-1])
+    points = points[inside]
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)[inside]
+
+    # Per axis: the voxels each point touches and the share it gives to each.
+    axis_shares = []
+    for axis, e in enumerate(edges):
+        n = len(e) - 1
+        u = (points[:, axis] - e[0]) * (n / (e[-1] - e[0])) - 0.5  # In voxel-center units.
+        if scheme == 'cic':
+            i = np.floor(u)
+            d = u - i
+            shares = [(i, 1 - d), (i + 1, d)]
+        else:
+            i = np.floor(u + 0.5)
+            d = u - i
+            shares = [(i - 1, 0.5 * (0.5 - d)**2), (i, 0.75 - d**2), (i + 1, 0.5 * (0.5 + d)**2)]
+        axis_shares.append([(np.clip(i, 0, n - 1).astype(np.intp), w) for i, w in shares])
+
+    for ix, wx in axis_shares[0]:
+        for iy, wy in axis_shares[1]:
+            for iz, wz in axis_shares[2]:
+                flat = (ix * shape[1] + iy) * shape[2] + iz
+                w = wx * wy * wz
+                if weights is not None:
+                    w *= weights
+                yield flat, w
+
+
+def _accumulate(out, flat, weights=None):
+    """
+    Adds the (optionally weighted) counts of the flat voxel indices into out.
+    """
+    if 8 * len(flat) < out.size:
+        # Few points for the grid: reduce over the occupied voxels only,
+        # instead of building a grid-sized temporary.
+        flat, counts = _sparse_counts(flat, weights, out.size)
+        target = out.reshape(-1)
+        target[flat] += counts.astype(out.dtype, copy=False)
+    else:
+        counts = np.bincount(flat, weights=weights, minlength=out.size)
+        np.add(out, counts.reshape(out.shape), out=out, casting='unsafe')
+
+
+def _sparse_counts(flat, weights, size):
+    """
+    Sorted occupied voxels of flat indices into a grid of size voxels, and their
+    (optionally weighted) counts.
+    """
+    if 8 * len(flat) >= size:
+        counts = np.bincount(flat, weights=weights, minlength=size)
+        occupied = np.flatnonzero(counts)
+        return occupied, counts[occupied]
+
+    if weights is None:
+        flat = np.sort(flat)
+    else:
+        order = np.argsort(flat)
+        flat = flat[order]
+        weights = weights[order]
+    starts = np.flatnonzero(np.diff(flat, prepend=-1))
+    if weights is None:
+        counts = np.diff(np.append(starts, len(flat)))
+    else:
+        counts = np.add.reduceat(weights, starts) if len(starts) else weights[:0]
+    return flat[starts], counts
+
+
 class Sample:
     def __init__(self, radial_profile, r_max=5):
         self.r_max = r_max
@@ -13,68 +248,367 @@ class Sample:
         # Pre-calculate the normalization factor over the intended active range.
         r_vals = np.linspace(0, self.r_max, self.M)
         func_vals = self.radial_profile(r_vals) * r_vals**2
-        integral_r = np.trapz(func_vals, r_vals)
+        integral_r = trapezoid(func_vals, r_vals)
         self.r_norm = integral_r
 
-        # Normalized radial profile function.
-        self.radial_profile_norm = lambda r: self.radial_profile(r) * r**2 / self.r_norm
+        # Envelope of the normalized profile for rejection sampling, computed once.
+        pdf_vals = self.radial_profile_norm(self.r_vals)
+        self.envelope_max = np.max(pdf_vals)
+
+        # Tabulated cumulative distribution for inverse-CDF sampling.
+        cdf_vals = np.concatenate([[0], np.cumsum(0.5 * (pdf_vals[1:] + pdf_vals[:-1]) * np.diff(self.r_vals))])
+        self.r_cdf = cdf_vals / cdf_vals[-1]
 
         self.a = 1
         self.b = 1
         self.c = 1
 
-    def sample_points(self, N=10000):
+    def radial_profile_norm(self, r):
+        """
+        Normalized radial profile function.
+        """
+        return self.radial_profile(r) * r**2 / self.r_norm
+
+    @instrument.timed('sample_points')
+    def sample_points(self, N=10000, method='rejection', rng=None, seed=None, chunk_size=CHUNK_SIZE):
+        """
+        Samples N points following the radial profile, scaled by the a, b, c axes.
+        :param N: Number of points to sample.
+        :param method: 'rejection' (batched rejection sampling against the envelope maximum)
+            or 'inverse' (inverse-CDF sampling from the tabulated profile, no rejections).
+        :param rng: Random generator (np.random.Generator). Defaults to the global np.random state.
+        :param seed: If given, points are drawn in chunks of chunk_size, each chunk from its own
+            stream spawned from this seed (see chunk_rng). Gives the same points as stream_density.
+        """
         N = int(N)
-        r = []
 
-        while len(r) < N:
-            radius = np.random.uniform(0, self.r_max)  # Sample within the entire range.
-            density = self.radial_profile_norm(radius)
-            
-            # Since we're already considering the active range in normalization,
-            # directly compare against a uniform distribution.
-            if np.random.uniform(0, max(self.radial_profile_norm(self.r_vals))) < density:
-                r.append(radius)
+        if seed is None:
+            points = self._draw_points(N, method=method, rng=rng)
+        else:
+            points = np.empty((3, N)).T
+            for i, start in enumerate(range(0, N, chunk_size)):
+                stop = min(start + chunk_size, N)
+                points[start:stop] = self._draw_points(stop - start, method=method, rng=chunk_rng(seed, i))
 
-        r = np.array(r)
-        theta = np.arccos(1 - 2 * np.random.random(N))  # Uniform distribution over theta
-        phi = 2 * np.pi * np.random.random(N)  # Uniform distribution over phi
+        self.points = points
+
+        return points
+
+    def _draw_points(self, N, method='rejection', rng=None):
+        """
+        Draws N points without storing them on the instance.
+        """
+        if rng is None:
+            rng = np.random
+
+        r = self.sample_radii(N, method=method, rng=rng)
+
+        theta = np.arccos(1 - 2 * rng.random(N))  # Uniform distribution over theta
+        phi = 2 * np.pi * rng.random(N)  # Uniform distribution over phi
 
         # Convert to Cartesian coordinates.
         x = r * np.sin(theta) * np.cos(phi)
         y = r * np.sin(theta) * np.sin(phi)
         z = r * np.cos(theta)
 
-        points = np.array([x * self.a, y * self.b, z * self.c]).T
+        return np.array([x * self.a, y * self.b, z * self.c]).T
 
-        self.points = points
+    def sample_radii(self, N, method='rejection', rng=None):
+        """
+        Samples N radii from the normalized radial profile.
+        """
+        N = int(N)
+        if rng is None:
+            rng = np.random
 
-        return points
+        if method == 'inverse':
+            return np.interp(rng.random(N), self.r_cdf, self.r_vals)
+        elif method != 'rejection':
+            raise ValueError('Invalid sampling method specified.')
+
+        r = np.empty(N)
+        filled = 0
+        max_block = 1 << 22
+
+        # Expected acceptance: the normalized profile integrates to one over [0, r_max].
+        acceptance = 1 / (self.r_max * self.envelope_max)
+
+        while filled < N:
+            remaining = N - filled
+            n_draw = min(int(1.1 * remaining / acceptance) + 16, max_block)
+
+            radius = rng.uniform(0, self.r_max, n_draw)  # Sample within the entire range.
+            density = self.radial_profile_norm(radius)
+            accepted = radius[rng.uniform(0, self.envelope_max, n_draw) < density]
+
+            # Size the next block from the measured acceptance rate.
+            acceptance = max(len(accepted) / n_draw, acceptance / 2, 1e-6)
 
-    def compute_density(self, ranges=[1, 1, 1], resolution=10, return_value=False):
+            take = min(len(accepted), remaining)
+            r[filled:filled + take] = accepted[:take]
+            filled += take
+
+            instrument.count('samples_accepted', take)
+            instrument.count('samples_rejected', n_draw - len(accepted))
+
+        return r
+
+    @instrument.timed('compute_density')
+    def compute_density(self, ranges=[1, 1, 1], resolution=10, return_value=False, weights=None,
+                        dtype='float64', scheme='ngp', noise=False):
         """
         Computes the volumetric density of points within each voxel.
+        :param weights: Optional per-point weights.
+        :param dtype: Accumulation dtype of the density ('float64' or 'float32').
+        :param scheme: Mass assignment, 'ngp' (plain binning), 'cic' or 'tsc' (see deposit_points).
+            The smoother schemes reach the same visual quality with far fewer points.
+        :param noise: Also compute self.noise, the per-voxel shot-noise estimate (see required_samples).
         """
 
         if not hasattr(self, 'points'):
             raise ValueError('Points have not been sampled yet.')
 
-        # Creating a histogram with the specified resolution
-        hist, edges = np.histogramdd(self.points, bins=resolution, range=[[-ranges[0], ranges[0]], [-ranges[1], ranges[1]], [-ranges[2], ranges[2]]])
-        
-        hist = hist
+        # Deposit on the uniform grid with the specified resolution
+        edges = grid_edges(ranges, resolution)
+        variance = np.zeros(tuple(len(e) - 1 for e in edges)) if noise else None
+        density = deposit_points(self.points, edges, scheme=scheme, weights=weights, dtype=dtype,
+                                 variance=variance)
 
-        density = hist #/ np.nansum(hist)
         self.density = density
         self.edges = edges
+        self.n_points = len(self.points)
+        if noise:
+            self.noise = np.sqrt(variance)
+
+        instrument.count('points_binned', len(self.points))
+        if instrument.active():
+            instrument.count('voxels_touched', int(np.count_nonzero(density)))
 
         if return_value:
             return density
         else:
             return
 
+    @instrument.timed('stream_density')
+    def stream_density(self, N, ranges=[1, 1, 1], resolution=10, seed=None, chunk_size=CHUNK_SIZE,
+                       method='rejection', scheme='ngp', noise=False, progress=None, resume=False,
+                       filename=None, dtype='float64', return_value=False):
+        """
+        Samples and bins N points chunk by chunk into a single density grid, so the full
+        points array never exists. Peak memory depends only on chunk_size and the grid.
+        Same result as sample_points(N, seed=seed, chunk_size=chunk_size) + compute_density.
+        :param seed: Seed for the chunk streams. If None, fresh entropy is drawn and kept
+            in self.stream_state so the run can still be resumed.
+        :param progress: Optional callable progress(points_done, N), called after each chunk.
+            Returning False stops the run; call again with resume=True to continue.
+        :param resume: Continue from self.stream_state instead of starting over.
+        :param scheme, noise: As in compute_density.
+        :param filename: If given, accumulate directly into the on-disk '{filename}.npy'
+            (see open_density) instead of an in-memory array.
+        :param dtype: Dtype of the density grid.
+        """
+        N = int(N)
+
+        if resume:
+            if not hasattr(self, 'stream_state'):
+                raise ValueError('There is no stream to resume.')
+            state = self.stream_state
+            if (state['N'], state['chunk_size']) != (N, chunk_size):
+                raise ValueError('N and chunk_size must match the stream being resumed.')
+            seed = state['seed']
+            density = self.density
+            edges = self.edges
+            variance = state['variance']
+        else:
+            if seed is None:
+                seed = np.random.SeedSequence().entropy
+            edges = grid_edges(ranges, resolution)
+            density = open_density(filename, edges, dtype)
+            variance = np.zeros(density.shape) if noise else None
+            state = {'N': N, 'seed': seed, 'chunk_size': chunk_size, 'chunks_done': 0,
+                     'variance': variance}
+
+        self.stream_state = state
+        self.density = density
+        self.edges = edges
+        self.n_points = N
+
+        n_chunks = -(-N // chunk_size)
 
+        for i in range(state['chunks_done'], n_chunks):
+            self._deposit_chunk(i, N, seed, chunk_size, method, edges, density, scheme, variance)
+            state['chunks_done'] = i + 1
 
+            if progress is not None and progress(min((i + 1) * chunk_size, N), N) is False:
+                break
+
+        if variance is not None:
+            self.noise = np.sqrt(variance)
+
+        instrument.count('points_binned', min(state['chunks_done'] * chunk_size, N))
+        if instrument.active():
+            instrument.count('voxels_touched', int(np.count_nonzero(density)))
+
+        if return_value:
+            return density
+        else:
+            return
+
+    @instrument.timed('parallel_density')
+    def parallel_density(self, N, ranges=[1, 1, 1], resolution=10, seed=None, workers=None,
+                         chunk_size=CHUNK_SIZE, method='rejection', scheme='ngp', noise=False,
+                         filename=None, dtype='float64', return_value=False):
+        """
+        Samples and bins N points over a pool of worker processes. Workers draw the chunks
+        of the same per-chunk streams as stream_density and reduce each one to the counts of
+        its occupied voxels, which are added into the grid in chunk order, so the result is
+        bit-identical for a given seed whatever the number of workers (for every scheme),
+        and equal to stream_density with the same seed and chunk_size. At most two chunks
+        per worker are in flight, so memory does not grow with N, and nothing grid-sized is
+        sent between processes.
+        :param workers: Number of processes (defaults to os.cpu_count()).
+        :param scheme, noise: As in compute_density.
+        :param filename, dtype: As in stream_density.
+        """
+        N = int(N)
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        if workers is None:
+            workers = os.cpu_count()
+        if scheme not in ['ngp', 'cic', 'tsc']:
+            raise ValueError('Invalid scheme specified.')
+
+        edges = grid_edges(ranges, resolution)
+        density = open_density(filename, edges, dtype)
+        variance = np.zeros(density.shape) if noise else None
+
+        n_chunks = -(-N // chunk_size)
+        workers = max(1, min(workers, n_chunks))
+
+        # Forked workers inherit the instance, so profiles defined as lambdas work too.
+        if 'fork' in mp.get_all_start_methods():
+            context = mp.get_context('fork')
+        else:
+            context = mp.get_context()
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(self,)) as executor:
+            # Flat views of the grids
+            targets = (density.reshape(-1), None if variance is None else variance.reshape(-1))
+            running = deque()
+            submitted = 0
+            while running or submitted < n_chunks:
+                while submitted < n_chunks and len(running) < 2 * workers:
+                    running.append(executor.submit(_chunk_shares, submitted, N, seed, chunk_size,
+                                                   method, edges, scheme, noise))
+                    submitted += 1
+
+                # The oldest chunk first: floating-point sums depend on the order
+                for flat, counts, squares in running.popleft().result():
+                    targets[0][flat] += counts.astype(density.dtype, copy=False)
+                    if noise:
+                        targets[1][flat] += squares
+
+        self.density = density
+        self.edges = edges
+        self.n_points = N
+        if noise:
+            self.noise = np.sqrt(variance)
+
+        instrument.count('points_binned', N)
+        if instrument.active():
+            instrument.count('voxels_touched', int(np.count_nonzero(density)))
+
+        if return_value:
+            return density
+        else:
+            return
+
+    def _deposit_chunk(self, i, N, seed, chunk_size, method, edges, out, scheme='ngp', variance=None):
+        """
+        Draws chunk i of a seeded run of N points and deposits it into out.
+        """
+        start = i * chunk_size
+        stop = min(start + chunk_size, N)
+        points = self._draw_points(stop - start, method=method, rng=chunk_rng(seed, i))
+
+        deposit_points(points, edges, scheme=scheme, out=out, variance=variance)
+
+    def required_samples(self, target_noise, quantile=0.5):
+        """
+        Estimates the number of points needed for the relative noise (noise / density) of
+        the occupied voxels to reach target_noise at the given quantile. Relative noise
+        scales as 1/sqrt(N), so this extrapolates from the last density computed with noise=True.
+        """
+        if not hasattr(self, 'noise'):
+            raise ValueError('Noise has not been computed yet.')
+
+        occupied = self.density > 0
+        relative = self.noise[occupied] / self.density[occupied]
+        current = np.quantile(relative, quantile)
+
+        return int(np.ceil(self.n_points * (current / target_noise)**2))
+
+    @instrument.timed('evaluate_density')
+    def evaluate_density(self, ranges=[1, 1, 1], resolution=10, N=None, supersample=1,
+                         return_value=False):
+        """
+        Evaluates the normalized profile directly on the voxel grid, without sampling points.
+        :param ranges: Half-widths of the grid along x, y, z (same as compute_density).
+        :param resolution: Number of voxels per axis (int or three ints).
+        :param N: If given, scale to expected counts for N points (comparable to compute_density).
+            Otherwise the density holds the probability mass in each voxel.
+        :param supersample: Sub-voxels per axis averaged in each voxel. The voxel mass is the
+            midpoint rule over the sub-voxel centers, so it converges to the exact cell
+            integral as supersample grows; use 4 or more where the profile changes a lot
+            within a voxel (e.g. a cusp at the center).
+        """
+
+        edges = grid_edges(ranges, resolution)
+        shape = tuple(len(e) - 1 for e in edges)
+        axes = np.array([self.a, self.b, self.c], dtype=float)
+
+        s = int(supersample)
+        widths = np.array([e[1] - e[0] for e in edges])
+        sub_widths = widths / s
+        offsets = (np.arange(s) + 0.5) / s - 0.5
+
+        density = np.zeros(shape)
+        y_c = 0.5 * (edges[1][1:] + edges[1][:-1])
+        z_c = 0.5 * (edges[2][1:] + edges[2][:-1])
+
+        # Work slab by slab along x to keep the temporaries two-dimensional.
+        for i in range(shape[0]):
+            x_c = 0.5 * (edges[0][i] + edges[0][i + 1])
+            for ox in offsets:
+                ux = (x_c + ox * widths[0]) / axes[0]
+                for oy in offsets:
+                    uy = ((y_c + oy * widths[1]) / axes[1])[:, None]
+                    for oz in offsets:
+                        uz = ((z_c + oz * widths[2]) / axes[2])[None, :]
+                        density[i] += self._cell_mass(ux, uy, uz, sub_widths / axes)
+
+        if N is not None:
+            density *= int(N)
+
+        self.density = density
+        self.edges = edges
+
+        if return_value:
+            return density
+        else:
+            return
+
+    def _cell_mass(self, ux, uy, uz, du):
+        """
+        Probability mass of axis-aligned cells centered at (ux, uy, uz) with widths du,
+        in the unscaled (unit-sphere) coordinates of the profile: the density at the cell
+        center times the cell volume.
+        """
+
+        r = np.sqrt(ux**2 + uy**2 + uz**2)
+        p = np.where(r <= self.r_max, self.radial_profile(r), 0) / (4 * np.pi * self.r_norm)
+        return p * du[0] * du[1] * du[2]
 
     def plot_density(self):
         """
@@ -104,24 +638,176 @@ class Sample:
         axs[2].imshow(yz_projection.T, extent=[y_edges[0], y_edges[-1], z_edges[0], z_edges[-1]], origin='lower', cmap=cmap)
 
 
-    def save_density(self, filename, float_precision='float32', compressed=False):
+    @instrument.timed('save_density')
+    def save_density(self, filename, float_precision='float32', compressed=False, **quantize):
         """
         Saves the volumetric density data to a raw binary file with specified precision.
         :param filename: The name of the file to save.
-        :param float_precision: The floating-point precision ('float64', 'float32', or 'float16').
+        :param float_precision: The floating-point precision ('float64', 'float32', or 'float16'),
+            or 'uint8'/'uint12' for the quantized '{filename}.npq' format (see
+            density_storage.save_quantized).
+        :param quantize: Options of save_quantized (companding, gamma, knee, max_error, chunk).
         """
 
         if not hasattr(self, 'density'):
             raise ValueError('Density data is not available.')
 
-        # Convert to specified precision
-        if float_precision in ['float64', 'float32', 'float16']:
-            density_data = self.density.astype(float_precision)
-        else:
+        if float_precision in ['uint8', 'uint12']:
+            return density_storage.save_quantized(filename, self.density, bits=int(float_precision[4:]),
+                                                  **quantize)
+
+        if float_precision not in ['float64', 'float32', 'float16']:
             raise ValueError('Invalid float precision specified.')
 
+        # Density accumulated straight into this file (see open_density) is already saved.
+        path = f'{filename}.npy'
+        if (not compressed and isinstance(self.density, np.memmap)
+                and self.density.dtype == float_precision
+                and os.path.abspath(self.density.filename) == os.path.abspath(path)):
+            self.density.flush()
+            return
+
+        # Convert to the specified precision slab by slab while writing, without a full copy.
         if compressed == True:
-            np.savez_compressed(f'{filename}.npz', density_data)
+            path = f'{filename}.npz'
+            with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+                with zf.open('arr_0.npy', 'w', force_zip64=True) as f:
+                    density_storage.write_npy(f, self.density, float_precision)
         else:
-            np.save(f'{filename}.npy', density_data)
+            # Write next to the target first, the density may be a memmap of that same file.
+            with open(path + '.tmp', 'wb') as f:
+                density_storage.write_npy(f, self.density, float_precision)
+            os.replace(path + '.tmp', path)
 
+        instrument.count('bytes_written', os.path.getsize(path))
+
+
+
+class SampleBatch:
+    """
+    Many variants of Sample, every radial profile with every a, b, c axis scaling,
+    sampled and binned in one pass into a stacked (variants, nx, ny, nz) density.
+    The profiles are tabulated on one radius grid and normalized together, and each
+    chunk of random draws (radius quantiles and unit directions) is shared by all
+    variants, so only the table lookup and the binning are done per variant. Sharing
+    the draws also makes differences between variants free of sampling noise.
+    Radii are drawn by inverse CDF, so each variant gets the same points as
+    Sample.sample_points(N, method='inverse', seed=seed, chunk_size=chunk_size).
+
+        batch = ut.SampleBatch([profile_1, profile_2], r_max=10, axes=[(1, 1, 1), (1, 1, 0.5)])
+        density = batch.compute_density(1e6, ranges=[10, 10, 10], resolution=128, seed=0)
+        density[batch.variant(1, 0)]  # profile_2 with axes (1, 1, 1)
+    """
+
+    def __init__(self, radial_profiles, r_max=5, axes=[(1, 1, 1)]):
+        """
+        :param radial_profiles: List of radial profile functions (vectorized over r).
+        :param axes: List of (a, b, c) axis scalings.
+        """
+        self.radial_profiles = list(radial_profiles)
+        self.axes = np.asarray(axes, dtype=float).reshape(-1, 3)
+        self.r_max = r_max
+        self.M = 1000
+        self.r_vals = np.linspace(0, self.r_max, self.M)
+
+        # Profiles tabulated once, (profiles, M), and normalized together.
+        table = np.array([np.broadcast_to(profile(self.r_vals), self.r_vals.shape)
+                          for profile in self.radial_profiles], dtype=float)
+        func_vals = table * self.r_vals**2
+        self.r_norm = trapezoid(func_vals, self.r_vals, axis=1)
+        pdf_vals = func_vals / self.r_norm[:, None]
+
+        # Tabulated cumulative distributions, as in Sample.
+        steps = 0.5 * (pdf_vals[:, 1:] + pdf_vals[:, :-1]) * np.diff(self.r_vals)
+        cdf_vals = np.concatenate([np.zeros((len(table), 1)), np.cumsum(steps, axis=1)], axis=1)
+        self.r_cdf = cdf_vals / cdf_vals[:, -1:]
+
+    def __len__(self):
+        return len(self.radial_profiles) * len(self.axes)
+
+    def variant(self, profile, axes):
+        """
+        Index of a variant given the indices of its profile and axis scaling.
+        """
+        return profile * len(self.axes) + axes
+
+    @instrument.timed('batch_density')
+    def compute_density(self, N, ranges=[1, 1, 1], resolution=10, seed=None, chunk_size=CHUNK_SIZE,
+                        scheme='ngp', filename=None, dtype='float64'):
+        """
+        Samples and bins N points for every variant, chunk by chunk (peak memory depends
+        only on chunk_size and the output).
+        :param seed: Seed for the chunk streams (see chunk_rng). Fresh entropy if None.
+        :param scheme: Mass assignment (see deposit_points).
+        :param filename: If given, the output is the on-disk 4-D '{filename}.npy' memmap,
+            so batches larger than memory can be built.
+        :return: Density of shape (len(self), nx, ny, nz); density[i] is variant i.
+        """
+        N = int(N)
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+
+        edges = grid_edges(ranges, resolution)
+        shape = (len(self),) + tuple(len(e) - 1 for e in edges)
+        if filename is None:
+            density = np.zeros(shape, dtype=dtype)
+        else:
+            density = np.lib.format.open_memmap(f'{filename}.npy', mode='w+', dtype=dtype, shape=shape)
+
+        for i, start in enumerate(range(0, N, chunk_size)):
+            n = min(chunk_size, N - start)
+            rng = chunk_rng(seed, i)
+
+            # Same draws, in the same order, as Sample._draw_points with method='inverse'
+            quantiles = rng.random(n)
+            theta = np.arccos(1 - 2 * rng.random(n))
+            phi = 2 * np.pi * rng.random(n)
+            directions = np.array([np.sin(theta) * np.cos(phi),
+                                   np.sin(theta) * np.sin(phi),
+                                   np.cos(theta)]).T
+
+            for p in range(len(self.radial_profiles)):
+                r = np.interp(quantiles, self.r_cdf[p], self.r_vals)
+                points = directions * r[:, None]
+
+                # With 'ngp', the voxel indices along an axis only depend on the scaling of
+                # that axis, so they are computed once for all variants scaled alike along it.
+                indices = {}
+                for a, axes in enumerate(self.axes):
+                    out = density[self.variant(p, a)]
+                    if scheme != 'ngp':
+                        deposit_points(points * axes, edges, scheme=scheme, out=out)
+                        continue
+
+                    flat = np.zeros(n, dtype=np.intp)
+                    inside = np.ones(n, dtype=bool)
+                    for axis, scale in enumerate(axes):
+                        if (axis, scale) not in indices:
+                            indices[axis, scale] = _axis_indices(points[:, axis] * scale, edges[axis])
+                        idx, axis_inside = indices[axis, scale]
+                        inside &= axis_inside
+                        flat *= len(edges[axis]) - 1
+                        flat += idx
+                    _accumulate(out, flat[inside])
+
+        self.density = density
+        self.edges = edges
+        self.n_points = N
+
+        instrument.count('points_binned', N * len(self))
+
+        return density
+
+    def sample(self, index):
+        """
+        Sample instance of variant index, holding its density from compute_density if
+        computed (for save_density, plot_density...).
+        """
+        p, a = divmod(index, len(self.axes))
+        sample = Sample(self.radial_profiles[p], r_max=self.r_max)
+        sample.a, sample.b, sample.c = self.axes[a]
+        if hasattr(self, 'density'):
+            sample.density = self.density[index]
+            sample.edges = self.edges
+            sample.n_points = self.n_points
+        return sample
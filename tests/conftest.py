@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Modules of code/ and blender/ are imported by name, as the scripts of the repository do
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(root, 'code'), os.path.join(root, 'blender')]
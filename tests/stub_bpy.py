@@ -0,0 +1,81 @@
+"""
+Minimal stand-in for the bpy module, with just what the tested helpers use, so they can
+be tested without Blender.
+"""
+import types
+
+
+class ID:
+    def __init__(self, name):
+        self.name = name
+        self.filepath = ''
+
+
+class Collection:
+    """
+    bpy.data collection: iterable, indexed and tested by name.
+    """
+
+    def __init__(self, names=()):
+        self.items = [ID(name) for name in names]
+
+    def __iter__(self):
+        return iter(list(self.items))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def get(self, name):
+        return next((item for item in self.items if item.name == name), None)
+
+    def new(self, name):
+        # Blender appends .001, .002... to taken names
+        unique, n = name, 0
+        while unique in self:
+            n += 1
+            unique = f'{name}.{n:03d}'
+        item = ID(unique)
+        self.items.append(item)
+        return item
+
+    def remove(self, item):
+        self.items.remove(item)
+
+
+class Data:
+    def __init__(self, types, orphans=0):
+        for data_type in types:
+            setattr(self, data_type, Collection())
+        self.types = types
+        self.orphans = orphans
+        self.batch_calls = []
+
+    def batch_remove(self, ids):
+        self.batch_calls.append(list(ids))
+        for data_type in self.types:
+            collection = getattr(self, data_type)
+            collection.items = [item for item in collection.items if item not in ids]
+
+    def orphans_purge(self, **kwargs):
+        # Purging frees data that was only used by the purged data, so it takes several calls
+        purged = min(self.orphans, 2)
+        self.orphans -= purged
+        return purged
+
+
+def make_bpy(data_types=('objects', 'materials', 'lights', 'cameras', 'images', 'meshes',
+                         'volumes', 'collections', 'worlds', 'node_groups'), orphans=0):
+    """
+    :param orphans: Orphan datablocks left to purge.
+    :return: The stub module, to be put in sys.modules['bpy'].
+    """
+    bpy = types.ModuleType('bpy')
+    bpy.data = Data(data_types, orphans)
+    bpy.path = types.SimpleNamespace(abspath=lambda path: path)
+    return bpy
@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+
+import utils as ut
+from density_cache import DensityCache
+
+
+def sample():
+    return ut.Sample(lambda r: np.exp(-r**2 / 2))
+
+
+def test_hit_and_miss(tmp_path):
+    cache = DensityCache(str(tmp_path))
+    first, _ = cache.density(sample(), 1e4, ranges=[3, 3, 3], resolution=8, seed=0)
+    second, _ = cache.density(sample(), 1e4, ranges=[3, 3, 3], resolution=8, seed=0)
+
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert np.array_equal(first, second)
+
+
+def test_lost_index(tmp_path):
+    cache = DensityCache(str(tmp_path))
+    cache.density(sample(), 1e4, ranges=[3, 3, 3], resolution=8, seed=0)
+    os.remove(cache.index_path)
+
+    # The finished entry folder is still there: a hit, not a failed rename
+    cache = DensityCache(str(tmp_path))
+    cache.density(sample(), 1e4, ranges=[3, 3, 3], resolution=8, seed=0)
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert cache.stats()['entries'] == 1
+
+
+def test_shared_cache(tmp_path):
+    # Two processes sharing a cache, each with its own in-memory index
+    a, b = DensityCache(str(tmp_path)), DensityCache(str(tmp_path))
+    a.density(sample(), 1e4, ranges=[3, 3, 3], resolution=8, seed=0)
+    b.density(sample(), 1e4, ranges=[3, 3, 3], resolution=8, seed=1)
+    b.density(sample(), 1e4, ranges=[3, 3, 3], resolution=8, seed=0)
+    a.density(sample(), 1e4, ranges=[3, 3, 3], resolution=8, seed=2)
+
+    assert (b.hits, b.misses) == (1, 1)
+    # Neither index overwrote the entries of the other
+    assert DensityCache(str(tmp_path)).stats()['entries'] == 3
+
+    a.clear()
+    assert DensityCache(str(tmp_path)).stats()['entries'] == 0
+    assert os.listdir(tmp_path) == ['index.json']
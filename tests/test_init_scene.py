@@ -0,0 +1,46 @@
+import sys
+
+import pytest
+
+from stub_bpy import make_bpy
+
+
+@pytest.fixture
+def bpy(monkeypatch):
+    stub = make_bpy(orphans=5)
+    monkeypatch.setitem(sys.modules, 'bpy', stub)
+    # Imported again, against this stub
+    monkeypatch.delitem(sys.modules, 'init_scene', raising=False)
+    return stub
+
+
+def test_reset_data(bpy):
+    bpy.data.objects.new('Cube')
+    bpy.data.objects.new('Cube')
+    bpy.data.materials.new('Volume')
+    bpy.data.collections.new('Collection')
+    bpy.data.collections.new('Extra')
+
+    import init_scene
+    counts = init_scene.reset_data(verbose=False)
+
+    # One batch_remove call per non-empty type
+    assert len(bpy.data.batch_calls) == 3
+    assert [c.name for c in bpy.data.collections] == ['Collection']
+    assert len(bpy.data.objects) == len(bpy.data.materials) == 0
+
+    # Orphans are purged until none is left
+    assert bpy.data.orphans == 0
+    assert counts['orphans'] == 5
+    assert counts['objects'] == 2 and counts['materials'] == 1 and counts['collections'] == 1
+    assert counts['meshes'] == 0
+    assert counts['seconds'] >= 0
+
+
+def test_reset_data_without_purge(bpy):
+    import init_scene
+    counts = init_scene.reset_data(purge=False, verbose=False)
+
+    assert bpy.data.batch_calls == []
+    assert bpy.data.orphans == 5
+    assert 'orphans' not in counts and 'seconds' in counts
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import density_storage as ds
+import utils as ut
+
+
+def density(shape=(19, 23, 17), seed=0):
+    # Exponential-like values over several decades, with empty voxels
+    rng = np.random.default_rng(seed)
+    values = rng.exponential(1.0, shape)**3
+    values[rng.random(shape) < 0.2] = 0
+    return values
+
+
+@pytest.mark.parametrize('bits', [8, 12])
+@pytest.mark.parametrize('companding', [None, 'log', 'power'])
+@pytest.mark.parametrize('chunk', [64, 7])
+def test_round_trip_within_max_error(tmp_path, bits, companding, chunk):
+    array = density()
+    header = ds.save_quantized(tmp_path / 'd', array, bits=bits, companding=companding, chunk=chunk)
+    loaded = ds.load_quantized(tmp_path / 'd')
+
+    assert loaded.shape == array.shape
+    assert header['bits'] == bits
+    # Decoding is in float32, which adds its own rounding on top of the bound
+    assert np.abs(loaded - array).max() <= header['max_error'] + 1e-6 * array.max()
+
+
+@pytest.mark.parametrize('bits', [8, 12])
+def test_linear_error_bound(tmp_path, bits):
+    array = density()
+    header = ds.save_quantized(tmp_path / 'd', array, bits=bits)
+    # Linear steps: half a step of the range
+    assert header['max_error'] == pytest.approx(array.max() / (2**bits - 1) / 2)
+
+
+def test_bits_chosen_from_max_error(tmp_path):
+    array = density()
+    loose = ds.save_quantized(tmp_path / 'a', array, max_error=array.max() / 100)
+    tight = ds.save_quantized(tmp_path / 'b', array, max_error=array.max() / 1000)
+    assert (loose['bits'], tight['bits']) == (8, 12)
+
+    with pytest.raises(ValueError):
+        ds.save_quantized(tmp_path / 'c', array, max_error=array.max() / 1e5)
+
+
+@pytest.mark.parametrize('bits', [8, 12])
+@pytest.mark.parametrize('chunk', [5, 8, 64])
+def test_region_reads(tmp_path, bits, chunk):
+    array = density()
+    ds.save_quantized(tmp_path / 'd', array, bits=bits, companding='log', chunk=chunk)
+    full = ds.load_quantized(tmp_path / 'd')
+
+    for region in [(slice(3, 11), slice(0, 23), slice(16, 17)),
+                   (slice(None), slice(7, 8), slice(2, None)),
+                   (slice(18, 19), slice(5, 20), slice(0, 9))]:
+        assert np.array_equal(ds.load_quantized(tmp_path / 'd', region=region), full[region])
+
+
+@pytest.mark.parametrize('companding', [None, 'log', 'power'])
+def test_all_zero_density(tmp_path, companding):
+    array = np.zeros((9, 9, 9))
+    header = ds.save_quantized(tmp_path / 'd', array, bits=8, companding=companding)
+    loaded = ds.load_quantized(tmp_path / 'd')
+
+    assert header['max_error'] == 0
+    assert np.array_equal(loaded, array)
+
+
+def test_save_density_quantized(tmp_path):
+    sample = ut.Sample(lambda r: np.exp(-r**2 / 2))
+    sample.density = density()
+    header = sample.save_density(tmp_path / 'd', float_precision='uint12', companding='log')
+
+    assert header['bits'] == 12
+    assert np.abs(ds.load_quantized(tmp_path / 'd') - sample.density).max() <= header['max_error'] + 1e-6 * sample.density.max()
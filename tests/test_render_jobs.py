@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+import render_jobs
+from render_jobs import FakeRenderer, expand_jobs, load_state, run_jobs
+
+
+def jobs():
+    return expand_jobs({'volume': ['a.vdb', 'b.vdb']}, frames=(1, 2))
+
+
+def test_renderer_is_abstract():
+    with pytest.raises(TypeError):
+        render_jobs.Renderer()
+
+
+def test_run_jobs(tmp_path):
+    state = run_jobs(jobs(), FakeRenderer(), str(tmp_path), workers=2)
+
+    assert all(entry['status'] == 'done' and entry['attempts'] == 1 for entry in state.values())
+    for job in jobs():
+        assert sorted(os.listdir(tmp_path / job['id'])) == ['0001.txt', '0002.txt', 'attempts']
+    assert load_state(str(tmp_path / 'state.json')) == state
+
+
+def test_retry(tmp_path):
+    state = run_jobs(jobs(), FakeRenderer(failures=1), str(tmp_path), retries=1)
+    assert all(entry['status'] == 'done' and entry['attempts'] == 2 for entry in state.values())
+
+    state = run_jobs(jobs(), FakeRenderer(failures=2), str(tmp_path / 'again'), retries=1)
+    assert all(entry['status'] == 'failed' and entry['attempts'] == 2 for entry in state.values())
+    assert all('Simulated failure 2' in entry['error'] for entry in state.values())
+
+
+def test_timeout(tmp_path):
+    state = run_jobs(jobs()[:1], FakeRenderer(seconds=30), str(tmp_path), retries=0, timeout=0.5)
+
+    entry, = state.values()
+    assert entry['status'] == 'failed' and entry['error'] == 'Timed out after 0.5 s'
+    assert entry['seconds'] < 5
+
+
+def test_resume(tmp_path, capsys):
+    state = run_jobs(jobs()[:1], FakeRenderer(), str(tmp_path))
+
+    # Jobs done in state.json are skipped, the others rendered
+    state = run_jobs(jobs(), FakeRenderer(), str(tmp_path))
+    assert 'Rendering 1 of 2 jobs' in capsys.readouterr().out
+    assert all(entry['status'] == 'done' and entry['attempts'] == 1 for entry in state.values())
+    with open(tmp_path / jobs()[0]['id'] / 'attempts') as f:
+        assert f.read() == '1'
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import utils as ut
+
+
+def test_normalization():
+    # Gaussian profile: the integral of exp(-r^2/2) r^2 over [0, inf) is sqrt(pi/2)
+    sample = ut.Sample(lambda r: np.exp(-r**2 / 2), r_max=10)
+    assert sample.r_norm == pytest.approx(np.sqrt(np.pi / 2), rel=1e-6)
+    assert sample.r_cdf[0] == 0 and sample.r_cdf[-1] == 1
+
+
+def test_batch_matches_samples():
+    profiles = [lambda r: np.exp(-r**2 / 2), lambda r: 1 / (1 + r**2)**2]
+    batch = ut.SampleBatch(profiles, axes=[(1, 1, 1), (2, 1, 0.5)])
+
+    assert len(batch) == 4
+    for p, profile in enumerate(profiles):
+        sample = ut.Sample(profile)
+        assert batch.r_norm[p] == pytest.approx(sample.r_norm)
+        assert np.allclose(batch.r_cdf[p], sample.r_cdf)
+
+
+def test_compute_density_positional_return_value():
+    # The original positional order (ranges, resolution, return_value) still holds
+    sample = ut.Sample(lambda r: np.exp(-r**2 / 2))
+    sample.points = np.random.default_rng(0).normal(size=(1000, 3))
+    density = sample.compute_density([3, 3, 3], 8, True)
+    assert density.shape == (8, 8, 8) and density.sum() == np.count_nonzero(
+        np.all(np.abs(sample.points) < 3, axis=1))
+
+
+@pytest.mark.parametrize('scheme', ['ngp', 'cic', 'tsc'])
+def test_parallel_density_independent_of_workers(scheme):
+    sample = ut.Sample(lambda r: np.exp(-r**2 / 2))
+    options = dict(ranges=[3, 3, 3], resolution=12, seed=1, chunk_size=20000, scheme=scheme, noise=True)
+
+    reference = sample.stream_density(1e5, return_value=True, **options).copy()
+    noise = sample.noise.copy()
+    for workers in [1, 2, 4]:
+        density = sample.parallel_density(1e5, workers=workers, return_value=True, **options)
+        assert np.array_equal(density, reference)
+        assert np.array_equal(sample.noise, noise)
@@ -0,0 +1,30 @@
+import numpy as np
+
+import density_storage as ds
+
+
+def frames(n=7, shape=(20, 17, 9), seed=0):
+    # Frames changing in a few places only, as in slow animations
+    rng = np.random.default_rng(seed)
+    frame = rng.random(shape)
+    result = []
+    for _ in range(n):
+        frame = frame.copy()
+        i, j, k = rng.integers(0, shape)
+        frame[i, j, k] += 1
+        result.append(frame)
+    return result
+
+
+def test_sequence_round_trip(tmp_path):
+    with ds.SequenceWriter(tmp_path / 's', keyframe_interval=3, block=4) as writer:
+        for frame in frames():
+            writer.append(frame)
+
+    reader = ds.SequenceReader(tmp_path / 's')
+    assert len(reader) == 7
+    # Random access and in-order streaming
+    for i in [6, 0, 4]:
+        assert np.array_equal(reader.frame(i), frames()[i])
+    assert all(np.array_equal(a, b) for a, b in zip(reader, frames()))
+    reader.close()
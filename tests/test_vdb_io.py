@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+import pytest
+
+import vdb_io
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def density(shape=(21, 30, 17), seed=0):
+    # Sparse blob, so some leaves stay empty
+    rng = np.random.default_rng(seed)
+    values = rng.random(shape)
+    values[values < 0.6] = 0
+    return values
+
+
+@pytest.mark.parametrize('half', [False, True])
+@pytest.mark.parametrize('compress', [False, True])
+def test_round_trip(tmp_path, half, compress):
+    array = density()
+    spool = vdb_io.LeafSpool('density', half=half, compress=compress)
+    spool.add_array(array, ijk=(3, -5, 8))
+    vdb_io.write_vdb(tmp_path / 'd.vdb', spool)
+    spool.close()
+
+    grid = vdb_io.read_vdb(tmp_path / 'd.vdb')['density']
+    dense, lo = vdb_io.grid_to_dense(grid)
+    # Back in array index space
+    i, j, k = np.array([3, -5, 8]) - lo
+    values = dense[i:i + array.shape[0], j:j + array.shape[1], k:k + array.shape[2]]
+
+    # Values are stored as float32, or rounded from float32 to half floats
+    expected = array.astype(np.float32)
+    if half:
+        expected = expected.astype(np.float16)
+    assert np.array_equal(values, expected)
+    # Nothing outside the array
+    assert dense.sum() == pytest.approx(values.sum())
+    assert grid['masks'].sum() == np.count_nonzero(array)
+
+
+def test_export_matches_array(tmp_path):
+    array = density()
+    vdb_io.export_density(array, tmp_path / 'd.vdb', tile=16)
+    dense, lo = vdb_io.grid_to_dense(vdb_io.read_vdb(tmp_path / 'd.vdb')['density'])
+
+    assert np.array_equal(lo, [0, 0, 0])
+    assert np.allclose(dense[:21, :30, :17], array / array.max())
+
+
+def test_crop_translation(tmp_path):
+    array = np.zeros((40, 40, 40))
+    array[12:20, 25:31, 3:9] = density((8, 6, 6))
+    vdb_io.export_density(array, tmp_path / 'full.vdb')
+    vdb_io.export_density(array, tmp_path / 'crop.vdb', crop=True)
+
+    full = vdb_io.read_vdb(tmp_path / 'full.vdb')['density']
+    crop = vdb_io.read_vdb(tmp_path / 'crop.vdb')['density']
+
+    # The crop offset moves into the transform, so voxels keep their world position
+    bbox = [12, 25, 3]
+    assert np.array_equal(crop['transform']['translation'], bbox)
+    full_dense, full_lo = vdb_io.grid_to_dense(full)
+    crop_dense, crop_lo = vdb_io.grid_to_dense(crop)
+    i, j, k = np.array(bbox) - full_lo
+    assert np.array_equal(crop_dense[-crop_lo[0]:8 - crop_lo[0], -crop_lo[1]:6 - crop_lo[1],
+                                     -crop_lo[2]:6 - crop_lo[2]],
+                          full_dense[i:i + 8, j:j + 6, k:k + 6])
+    assert crop_dense.sum() == pytest.approx(full_dense.sum())
+
+
+def test_lod_mass_conservation(tmp_path):
+    array = density((37, 20, 26))
+    path = str(tmp_path / 'd.vdb')
+    vdb_io.export_density(array, path)
+    vdb_io.export_lods(array, path, levels=2)
+    assert vdb_io.lod_factors(path) == [1, 2, 4]
+
+    masses = []
+    for factor in vdb_io.lod_factors(path):
+        grid = vdb_io.read_vdb(vdb_io.lod_path(path, factor))['density']
+        assert np.allclose(grid['transform']['voxel_size'], factor)
+        # Every level is normalized by the full-resolution maximum
+        masses.append(vdb_io.grid_to_dense(grid)[0].sum() * factor**3)
+    assert np.allclose(masses, masses[0], rtol=1e-5)
+
+
+def test_read_pyopenvdb_file():
+    grids = vdb_io.read_vdb(os.path.join(ROOT, 'blender', 'vdb_files', 'density.vdb'))
+    grid = grids['density']
+    dense, lo = vdb_io.grid_to_dense(grid)
+
+    assert list(grids) == ['density']
+    assert np.array_equal(lo, [0, 0, 0])
+    assert dense.max() == 1
+    assert np.count_nonzero(dense) == grid['metadata']['file_voxel_count'] == grid['masks'].sum()
+
+
+@pytest.mark.parametrize('fill', [0.0, np.nan])
+def test_empty_frame(tmp_path, fill):
+    array = np.full((16, 16, 16), fill)
+    path = str(tmp_path / 'd.vdb')
+    vdb_io.export_density(array, path, crop=True, fields=vdb_io.shading_fields())
+    vdb_io.export_lods(array, path, levels=1)
+
+    for file in [path, vdb_io.lod_path(path, 2)]:
+        grids = vdb_io.read_vdb(file)
+        assert all(len(grid['origins']) == 0 and not grid['tiles'] for grid in grids.values())
+    assert len(grids) == 1
@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pytest
+
+import instrument
+from stub_bpy import make_bpy
+
+
+@pytest.fixture
+def lblut(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'bpy', make_bpy())
+    # Imported again, against this stub (and with an empty cache)
+    monkeypatch.delitem(sys.modules, 'local_blutils', raising=False)
+    import local_blutils
+    return local_blutils
+
+
+def counters(func):
+    records = []
+    instrument.add_sink(records.append)
+    try:
+        with instrument.stage('test'):
+            result = func()
+    finally:
+        instrument.remove_sink(records.append)
+    return result, records[-1]['counters']
+
+
+def test_volume_data_cache(lblut, tmp_path):
+    path = tmp_path / 'density.vdb'
+    path.write_bytes(b'grid')
+
+    first, counts = counters(lambda: lblut.volume_data(str(path)))
+    assert first.name == 'density' and first.filepath == str(path)
+    assert counts == {'volume_imports': 1}
+
+    # Unchanged file: the same datablock
+    second, counts = counters(lambda: lblut.volume_data(str(path)))
+    assert second is first
+    assert counts == {'volume_cache_hits': 1}
+    assert len(lblut.bpy.data.volumes) == 1
+
+
+@pytest.mark.parametrize('change', ['mtime', 'size'])
+def test_volume_data_reload(lblut, tmp_path, change):
+    path = tmp_path / 'density.vdb'
+    path.write_bytes(b'grid')
+    first = lblut.volume_data(str(path))
+
+    if change == 'mtime':
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    else:
+        path.write_bytes(b'larger grid')
+
+    # Reloaded in place, then cached again
+    second, counts = counters(lambda: lblut.volume_data(str(path)))
+    assert second is first
+    assert counts == {'volume_reloads': 1}
+    assert counters(lambda: lblut.volume_data(str(path)))[1] == {'volume_cache_hits': 1}
+
+
+def test_clear_volume_cache(lblut, tmp_path):
+    paths = [tmp_path / 'a.vdb', tmp_path / 'b.vdb']
+    for path in paths:
+        path.write_bytes(b'grid')
+    volumes = [lblut.volume_data(str(path)) for path in paths]
+
+    lblut.clear_volume_cache(str(paths[0]))
+    assert lblut.volume_data(str(paths[0])) is not volumes[0]
+    assert lblut.volume_data(str(paths[1])) is volumes[1]
+
+    lblut.clear_volume_cache()
+    assert lblut.volume_data(str(paths[1])) is not volumes[1]
+    assert [volume.name for volume in lblut.bpy.data.volumes] == ['a', 'b', 'a.001', 'b.001']
+
+
+def test_removed_datablock_is_imported_again(lblut, tmp_path):
+    path = tmp_path / 'density.vdb'
+    path.write_bytes(b'grid')
+    first = lblut.volume_data(str(path))
+
+    lblut.bpy.data.volumes.remove(first)
+    assert lblut.volume_data(str(path)) is not first